@@ -0,0 +1,364 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import pygame
+from game.config import (
+    BASE_POKEMON_SIZE,
+    COLLISIONS,
+    DIRTY_RECTS,
+    POKEMONS_PER_TEAM,
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+)
+from game.controllers import GameManager, NullVisualManager, VisualManager
+from game.pokemons import POKEMON_TYPES
+
+PHASES = ("handle_events", "update", "draw", "update_screen")
+
+# own import time of the game's modules, pygame and numpy not included
+GAME_IMPORT_BUDGET_MS = 50
+
+# runs in a fresh interpreter, prints milliseconds since the process started for
+# every step up to the first menu frame on the screen
+STARTUP_PROBE = """
+import os, time
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+start = time.perf_counter()
+from game.config import DIRTY_RECTS, FPS, SCREEN_HEIGHT, SCREEN_WIDTH
+from game.controllers import GameManager, VisualManager
+imported = time.perf_counter()
+vm = VisualManager((SCREEN_WIDTH, SCREEN_HEIGHT), "startup", dirty_rects=DIRTY_RECTS)
+game = GameManager(vm)
+created = time.perf_counter()
+while game.state_name != "menu":
+    game.handle_events()
+    game.update()
+    game.draw()
+    game.update_screen()
+    vm.clock.tick(FPS)
+game.draw()
+game.update_screen()
+drawn = time.perf_counter()
+print(*((t - start) * 1000 for t in (imported, created, drawn)))
+"""
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: list) -> dict:
+    return {
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "mean": sum(samples) / len(samples),
+    }
+
+
+def random_pos() -> tuple:
+    return (
+        random.randint(0, SCREEN_WIDTH - BASE_POKEMON_SIZE[0]),
+        random.randint(0, SCREEN_HEIGHT - BASE_POKEMON_SIZE[1]),
+    )
+
+
+def mouse_events(frame: int) -> list:
+    pos = random_pos()
+    events = [
+        pygame.event.Event(pygame.MOUSEMOTION, pos=pos, rel=(0, 0), buttons=(0,) * 3)
+    ]
+    if frame % 30 == 0:
+        events.append(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=pos, button=1))
+        events.append(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=pos, button=1))
+    return events
+
+
+# every scenario gets (game, entities), sets the state up and returns a callable
+# producing the synthetic events for a frame number
+
+
+def setup_menu(game: GameManager, entities: int):
+    game.state = "menu"
+    # clicks would leave the menu, hovering is enough to animate the buttons
+    return lambda frame: mouse_events(frame)[:1]
+
+
+def setup_world(name: str):
+    def setup(game: GameManager, entities: int):
+        game.state = name
+        state = game.state
+        state.max_pokemons = max(state.max_pokemons, entities)
+        state.clear_pokemons()
+        for _ in range(entities):
+            state.add_new_random_pokemon(random_pos())
+        return mouse_events
+
+    return setup
+
+
+def setup_battle(game: GameManager, entities: int):
+    game.box = [
+        random.choice(POKEMON_TYPES)("P", (0, 0), game.vm)
+        for _ in range(POKEMONS_PER_TEAM)
+    ]
+    game.state = "battle"
+    state = game.state
+
+    def events(frame: int) -> list:
+        # a finished battle is restarted right away, so every frame has work to do
+        if state.difficulty is None or state.winner is not None:
+            state.enter()
+            return [pygame.event.Event(pygame.KEYDOWN, key=pygame.K_3)]
+        # one hit per frame instead of one per HIT_DELAY
+        state.battle.clock = None
+        return []
+
+    return events
+
+
+SCENARIOS = {
+    "menu": (setup_menu, False),
+    "collect": (setup_world("collect"), True),
+    "battle": (setup_battle, False),
+    "fps": (setup_world("fps"), True),
+}
+
+
+def run_scenario(
+    game: GameManager,
+    setup,
+    entities: int,
+    frames: int,
+    warmup: int,
+    collisions: bool = COLLISIONS,
+) -> dict:
+    timings = {phase: [] for phase in PHASES}
+    timings["frame"] = []
+    events = setup(game, entities)
+    if hasattr(game.state, "collisions"):
+        game.state.collisions = collisions
+    clock = time.perf_counter
+
+    for frame in range(warmup + frames):
+        game.vm.events()  # drop whatever the window queued
+        for event in events(frame):
+            game.vm.post(event)
+
+        t0 = clock()
+        game.handle_events()
+        t1 = clock()
+        game.tick()
+        t2 = clock()
+        game.draw()
+        t3 = clock()
+        game.update_screen()
+        t4 = clock()
+
+        if frame >= warmup:
+            for phase, start, end in zip(PHASES, (t0, t1, t2, t3), (t1, t2, t3, t4)):
+                timings[phase].append((end - start) * 1000)
+            timings["frame"].append((t4 - t0) * 1000)
+
+    return {phase: summarize(samples) for phase, samples in timings.items()}
+
+
+def import_times() -> dict:
+    # self and cumulative microseconds per module from python -X importtime
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import game.controllers"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        if own.strip().isdigit():
+            times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def measure_startup(runs: int) -> dict:
+    imports, samples = [], []
+    for _ in range(runs):
+        times = import_times()
+        game_us = sum(
+            own
+            for name, (own, _) in times.items()
+            if name == "game" or name.startswith("game.")
+        )
+        imports.append((game_us / 1000, times["game.controllers"][1] / 1000))
+
+        wall_start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        wall = (time.perf_counter() - wall_start) * 1000
+        samples.append((*map(float, output.split()), wall))
+
+    imported, created, drawn, wall = map(statistics.median, zip(*samples))
+    return {
+        "runs": runs,
+        "game_imports_ms": statistics.median(own for own, _ in imports),
+        "all_imports_ms": statistics.median(total for _, total in imports),
+        "imported_ms": imported,
+        "created_ms": created,
+        "first_frame_ms": drawn,
+        "process_ms": wall,
+    }
+
+
+def report_startup(startup: dict) -> bool:
+    print(
+        f"imports: game {startup['game_imports_ms']:.1f} ms "
+        f"(budget {GAME_IMPORT_BUDGET_MS} ms), with pygame {startup['all_imports_ms']:.1f} ms"
+    )
+    print(
+        f"startup: imported {startup['imported_ms']:.1f} ms, "
+        f"managers {startup['created_ms']:.1f} ms, "
+        f"first menu frame {startup['first_frame_ms']:.1f} ms, "
+        f"whole process {startup['process_ms']:.1f} ms "
+        f"(median of {startup['runs']})"
+    )
+    return startup["game_imports_ms"] <= GAME_IMPORT_BUDGET_MS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure frame times of every game state without a window."
+    )
+    parser.add_argument("states", nargs="*", default=list(SCENARIOS))
+    parser.add_argument(
+        "-e", "--entities", type=int, nargs="+", default=[100, 1000, 10000]
+    )
+    parser.add_argument("-f", "--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="benchmark.json")
+    parser.add_argument(
+        "--dirty-rects", action=argparse.BooleanOptionalAction, default=DIRTY_RECTS
+    )
+    parser.add_argument(
+        "--null",
+        action="store_true",
+        help="run on the null backend, no window and no drawing, to time the "
+        "game logic alone",
+    )
+    parser.add_argument(
+        "--collisions", action=argparse.BooleanOptionalAction, default=COLLISIONS
+    )
+    parser.add_argument(
+        "--startup",
+        type=int,
+        nargs="?",
+        const=5,
+        default=0,
+        metavar="RUNS",
+        help="only measure imports and the time to the first menu frame, "
+        "in fresh processes",
+    )
+
+    args = parser.parse_args()
+    for state in args.states:
+        if state not in SCENARIOS:
+            parser.error(f"unknown state {state!r}, pick from {', '.join(SCENARIOS)}")
+    return args
+
+
+def main() -> None:
+    args = parse_args()
+    random.seed(args.seed)
+
+    if args.startup:
+        startup = measure_startup(args.startup)
+        within_budget = report_startup(startup)
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python": sys.version.split()[0],
+                    "pygame": pygame.version.ver,
+                    "platform": platform.platform(),
+                    "startup": startup,
+                },
+                f,
+                indent=2,
+            )
+        print(f"written to {args.output}")
+        if not within_budget:
+            raise SystemExit("the game's own imports are over budget")
+        return
+
+    if args.null:
+        vm = NullVisualManager((SCREEN_WIDTH, SCREEN_HEIGHT))
+    else:
+        vm = VisualManager(
+            (SCREEN_WIDTH, SCREEN_HEIGHT), "benchmark", dirty_rects=args.dirty_rects
+        )
+    game = GameManager(vm, preload=False)
+
+    results = []
+    for name in args.states:
+        setup, scaled = SCENARIOS[name]
+        for entities in args.entities if scaled else [0]:
+            phases = run_scenario(
+                game, setup, entities, args.frames, args.warmup, args.collisions
+            )
+            results.append(
+                {
+                    "state": name,
+                    "entities": entities,
+                    "frames": args.frames,
+                    "phases": phases,
+                }
+            )
+            frame = phases["frame"]
+            print(
+                f"{name:>8} {entities:>6}  p50 {frame['p50']:7.2f} ms  "
+                f"p95 {frame['p95']:7.2f} ms  p99 {frame['p99']:7.2f} ms  "
+                f"{1000 / frame['mean']:8.0f} ticks/s"
+            )
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "pygame": pygame.version.ver,
+        "platform": platform.platform(),
+        "backend": "null" if args.null else "window",
+        "dirty_rects": args.dirty_rects,
+        "collisions": args.collisions,
+        "seed": args.seed,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"written to {args.output}")
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,147 @@
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
 import pygame
+from game.damage import raw_damage
 
 HIT_DELAY = 200
 
 # I inserted this code as it was provided from teacher
 
 
+class Hit(NamedTuple):
+    turn: int
+    side: int  # 1 - player's pokemon attacks, 2 - bot's pokemon attacks
+    attacker: str
+    defender: str
+    damage: int
+    hp: int  # defender's hp after the hit
+    knocked_out: bool
+
+
+class BattleResult(NamedTuple):
+    winner: int  # 1 - player, 2 - bot
+    turns: int
+    hits: List[Hit]
+
+
+class Resolution(NamedTuple):
+    winner: int  # 0 - nobody had pokemons
+    turns: int
+    survivors: list  # (pokemon, hp) of the winner's remaining team
+
+
+# (type_id, atk, df, hp)
+Stats = Tuple[int, int, int, int]
+
+
+def duel(
+    first_damage: int, first_hp: int, second_damage: int, second_hp: int
+) -> Tuple[bool, int, int]:
+    # one pairing of the fight in Battle.step, first strikes first: damage is
+    # fixed per pair, so the hits needed for a knock out are just a division.
+    # returns (whether first wins, turns it took, the winner's hp)
+    if second_hp <= 0:
+        # a pokemon that came in knocked out deals nothing and falls on the
+        # opponent's next turn
+        return True, 1, first_hp
+    if first_hp <= 0:
+        return False, 2, second_hp
+
+    first_hits = -(-second_hp // first_damage)
+    second_hits = -(-first_hp // second_damage)
+    # whoever strikes first wins a tie in the number of hits needed
+    if first_hits <= second_hits:
+        return True, 2 * first_hits - 1, first_hp - (first_hits - 1) * second_damage
+    return False, 2 * second_hits, second_hp - second_hits * first_damage
+
+
+def resolve_stats(
+    player: Sequence[Stats], bot: Sequence[Stats]
+) -> Tuple[int, int, int, int]:
+    # plays the same fight as Battle.step, a whole duel at a time.
+    # returns (winner, turns, index of the winner's front pokemon, its hp)
+    if not player or not bot:
+        if player:
+            return 1, 0, 0, player[0][3]
+        if bot:
+            return 2, 0, 0, bot[0][3]
+        return 0, 0, 0, 0
+
+    i = j = 0
+    a_hp, b_hp = player[0][3], bot[0][3]
+    player_first, turns = True, 0
+
+    while True:
+        a_type, a_atk, a_df, _ = player[i]
+        b_type, b_atk, b_df, _ = bot[j]
+        a_damage = raw_damage(a_type, a_atk, b_type, b_df)
+        b_damage = raw_damage(b_type, b_atk, a_type, a_df)
+
+        if player_first:
+            player_wins, took, hp = duel(a_damage, a_hp, b_damage, b_hp)
+        else:
+            bot_wins, took, hp = duel(b_damage, b_hp, a_damage, a_hp)
+            player_wins = not bot_wins
+        turns += took
+
+        if player_wins:
+            j += 1
+            if j == len(bot):
+                return 1, turns, i, max(0, hp)
+            a_hp, b_hp = hp, bot[j][3]
+            player_first = False
+        else:
+            i += 1
+            if i == len(player):
+                return 2, turns, j, max(0, hp)
+            a_hp, b_hp = player[i][3], hp
+            player_first = True
+
+
+def pokemon_stats(p) -> Stats:
+    return (p.type_id, p.atk, p.df, p.hp)
+
+
+def team_stats(team) -> List[Stats]:
+    return [(p.type_id, p.atk, p.df, p.hp) for p in team]
+
+
+def resolve(player_team: list, bot_team: list, cache=None) -> Resolution:
+    # cache is an OutcomeCache from game.outcomes, or None to always compute
+    player, bot = team_stats(player_team), team_stats(bot_team)
+    if cache is not None:
+        winner, turns, front, hp = cache.resolve(player, bot)
+    else:
+        winner, turns, front, hp = resolve_stats(player, bot)
+    if winner == 0:
+        return Resolution(0, 0, [])
+
+    team = player_team if winner == 1 else bot_team
+    survivors = [(team[front], hp)] + [(p, p.hp) for p in team[front + 1 :]]
+    return Resolution(winner, turns, survivors)
+
+
 class Battle:
-    def __init__(self, n):
+    def __init__(
+        self,
+        n,
+        clock: Optional[Callable[[], int]] = pygame.time.get_ticks,
+        hit_delay: int = HIT_DELAY,
+        record: bool = True,
+        recorder=None,
+        cache=None,
+    ):
+        # clock=None drops the pacing, every update() is one hit
         self.n = n
+        self.clock = clock
+        self.hit_delay = hit_delay
+        self.record = record
+        # gets the rosters, every hit and the result, see game.replay
+        self.recorder = recorder
+        # outcomes of fast_forward are looked up here first, see game.outcomes
+        self.cache = cache
         self.started = False
+        self.result: Optional[BattleResult] = None
 
     def start(self, player_trainer, bot_trainer):
         if self.started:
@@ -17,30 +150,48 @@ class Battle:
         self.player_trainer = player_trainer
         self.bot_trainer = bot_trainer
         self.player_team = player_trainer.best_team(self.n)
-        self.bot_team = bot_trainer.best_team(self.n)
+        # the bot picks second and sees the player's team
+        self.bot_team = bot_trainer.best_team(self.n, opponent=self.player_team)
 
         self.turn = 1
+        self.turns = 0
+        self.hits: List[Hit] = []
+        self.result = None
         self.started = True
-        self.last_update = pygame.time.get_ticks()
+        self.last_update = self.now()
+
+        if self.recorder is not None:
+            self.recorder.start(self)
+
+    def now(self) -> int:
+        return self.clock() if self.clock is not None else 0
 
     def update(self):
         if not self.started:
             return
 
-        now = pygame.time.get_ticks()
-        if now - self.last_update <= HIT_DELAY:
+        if self.clock is not None:
+            now = self.clock()
+            if now - self.last_update <= self.hit_delay:
+                return
+            self.last_update = now
+
+        return self.step()
+
+    def step(self):
+        if not self.started:
             return
-        self.last_update = now
 
         if self.player_team and self.bot_team:
+            self.turns += 1
             if self.turn == 1:
-                self.player_team[0].attack(self.bot_team[0])
+                self.hit(self.player_team[0], self.bot_team[0])
                 if self.bot_team[0].hp <= 0:
                     self.bot_team.pop(0)
                     if not self.bot_team:
                         return self.finish(1)
             else:
-                self.bot_team[0].attack(self.player_team[0])
+                self.hit(self.bot_team[0], self.player_team[0])
                 if self.player_team[0].hp <= 0:
                     self.player_team.pop(0)
                     if not self.player_team:
@@ -48,6 +199,65 @@ class Battle:
 
             self.turn = 2 if self.turn == 1 else 1
 
+    def hit(self, attacker, defender) -> None:
+        hp = defender.hp
+        attacker.attack(defender)
+
+        if self.recorder is not None:
+            self.recorder.hit(self.turn, hp - defender.hp, defender.hp)
+
+        if self.record:
+            self.hits.append(
+                Hit(
+                    self.turns,
+                    self.turn,
+                    attacker.name,
+                    defender.name,
+                    hp - defender.hp,
+                    defender.hp,
+                    defender.hp <= 0,
+                )
+            )
+
+    def run(self) -> Optional[BattleResult]:
+        # resolves the whole fight right away, ignoring the clock
+        while self.started and self.player_team and self.bot_team:
+            self.step()
+
+        # a side that came without pokemons loses without a fight
+        if self.started:
+            self.finish(2 if self.bot_team else 1 if self.player_team else 0)
+
+        return self.result
+
+    def fast_forward(self) -> Optional[BattleResult]:
+        # like run(), but from the closed form resolution, without a hit log
+        if not self.started:
+            return self.result
+        if self.recorder is not None:
+            # a recording needs every hit
+            return self.run()
+
+        resolution = resolve(self.player_team, self.bot_team, self.cache)
+        if resolution.winner == 0:
+            self.finish(0)
+            return self.result
+
+        survivors = {id(p): hp for p, hp in resolution.survivors}
+        for p in self.player_team + self.bot_team:
+            p.hp = survivors.get(id(p), 0)
+
+        if resolution.winner == 1:
+            self.player_team = [p for p, _ in resolution.survivors]
+            self.bot_team = []
+        else:
+            self.bot_team = [p for p, _ in resolution.survivors]
+            self.player_team = []
+
+        self.turns += resolution.turns
+        self.finish(resolution.winner)
+        return self.result
+
     def finish(self, result):
         if not self.started:
             return
@@ -64,6 +274,10 @@ class Battle:
         elif result == 2:
             self.bot_trainer.wins += 1
 
+        self.result = BattleResult(result, self.turns, self.hits)
+        if self.recorder is not None:
+            self.recorder.finish(self.result)
+
     def current_pair(self):
         if not self.started or not self.player_team or not self.bot_team:
             return None, None
@@ -0,0 +1,188 @@
+from game.config import SCREEN_HEIGHT, SCREEN_WIDTH
+
+try:
+    import numpy as np
+except ImportError:  # collisions fall back to plain python lists
+    np = None
+
+# boxes of one neighbouring cell a box is checked against, see find_pairs
+CELL_CONTACTS = 8
+# where find_pairs puts the empty slots of its candidate table, far off screen
+FAR = -(1 << 40)
+
+
+def find_pairs(x, y, w, h, limit: int = CELL_CONTACTS):
+    # uniform grid with cells as big as the biggest box: two boxes can only
+    # overlap when their top-left corners are in the same or neighbouring cells.
+    # a box is checked against at most `limit` boxes of every neighbouring cell,
+    # a crowd too dense to pull apart costs no more than a busy one
+    if np is None:
+        return _find_pairs_list(x, y, w, h)
+
+    n = len(x)
+    empty = np.zeros(0, dtype=np.int64)
+    if n < 2:
+        return empty, empty
+
+    size = max(int(w.max()), int(h.max()), 1)
+    cx, cy = x // size, y // size
+    cx -= cx.min()
+    cy -= cy.min()
+    # a spare row under every column, so a neighbour above row 0 or below the
+    # last row lands in an empty cell instead of the next column
+    rows = int(cy.max()) + 2
+    cell = cx * rows + cy
+    # and a spare column for the neighbours right of the last one
+    cell_count = (int(cx.max()) + 2) * rows
+
+    # everything in cell order, a cell's boxes are one run starting at starts[cell]
+    order = np.argsort(cell, kind="stable")
+    cells = cell[order]
+    starts = np.searchsorted(cells, np.arange(cell_count + 1))
+
+    # n stands for an empty slot, a box at FAR that overlaps nothing
+    k = np.arange(limit)
+    first = starts[:-1, None] + k
+    first[first >= starts[1:, None]] = n
+    # every pair of cells once: the boxes after each box in its own cell, then
+    # the first ones of the cell below and of the column to the right
+    after = np.arange(n)[:, None] + (k + 1)
+    after[after >= starts[cells + 1][:, None]] = n
+    neighbours = first[cells[:, None] + np.array([1, rows - 1, rows, rows + 1])]
+    candidates = np.concatenate((after, neighbours.reshape(n, -1)), axis=1)
+
+    left, top, right, bottom = (np.full(n + 1, FAR, dtype=np.int64) for _ in range(4))
+    left[:n], top[:n] = x[order], y[order]
+    right[:n], bottom[:n] = left[:n] + w[order], top[:n] + h[order]
+    overlap = left[candidates] < right[:n, None]
+    overlap &= left[:n, None] < right[candidates]
+    overlap &= top[candidates] < bottom[:n, None]
+    overlap &= top[:n, None] < bottom[candidates]
+
+    found = np.flatnonzero(overlap)
+    if not len(found):
+        return empty, empty
+    a = order[found // candidates.shape[1]]
+    b = order[candidates.reshape(-1)[found]]
+    # the lower index first, so ties in collide go by index
+    return np.minimum(a, b), np.maximum(a, b)
+
+
+def _find_pairs_list(x, y, w, h, limit: int = CELL_CONTACTS):
+    # the same grid and limit with dicts and lists
+    n = len(x)
+    if n < 2:
+        return [], []
+
+    size = max(max(w), max(h), 1)
+    min_cx = min(v // size for v in x)
+    min_cy = min(v // size for v in y)
+    cells: dict = {}
+    for i in range(n):
+        key = (x[i] // size - min_cx, y[i] // size - min_cy)
+        cells.setdefault(key, []).append(i)
+
+    found_a, found_b = [], []
+    for (cx, cy), members in sorted(cells.items()):
+        neighbours = [
+            cells.get(key, ())
+            for key in ((cx, cy + 1), (cx + 1, cy - 1), (cx + 1, cy), (cx + 1, cy + 1))
+        ]
+        for k, i in enumerate(members):
+            xi, yi, wi, hi = x[i], y[i], w[i], h[i]
+            for others in [members[k + 1 : k + 1 + limit]] + neighbours:
+                for j in others[:limit]:
+                    if xi < x[j] + w[j] and x[j] < xi + wi:
+                        if yi < y[j] + h[j] and y[j] < yi + hi:
+                            found_a.append(min(i, j))
+                            found_b.append(max(i, j))
+    return found_a, found_b
+
+
+def collide(x, y, dx, dy, w, h, width=SCREEN_WIDTH, height=SCREEN_HEIGHT) -> int:
+    # separates overlapping boxes along the axis they overlap least on and swaps
+    # their speeds on it, an elastic bounce of equal masses. arrays are changed
+    # in place, returns the number of colliding pairs
+    if np is None:
+        return _collide_list(x, y, dx, dy, w, h, width, height)
+
+    a, b = find_pairs(x, y, w, h)
+    if not len(a):
+        return 0
+
+    ox = np.minimum(x[a] + w[a], x[b] + w[b]) - np.maximum(x[a], x[b])
+    oy = np.minimum(y[a] + h[a], y[b] + h[b]) - np.maximum(y[a], y[b])
+    along_x = ox <= oy
+
+    n = len(x)
+    for pos, speed, overlap, mask in ((x, dx, ox, along_x), (y, dy, oy, ~along_x)):
+        i, j, depth = a[mask], b[mask], overlap[mask]
+        if not len(i):
+            continue
+
+        # +1 when j sits on the far side of i, ties go by index
+        side = np.where(pos[j] >= pos[i], 1, -1)
+        # a box touching several others gets the average of its corrections, so
+        # crowds don't blow up the speeds
+        contacts = np.bincount(i, minlength=n) + np.bincount(j, minlength=n)
+        contacts = np.maximum(contacts, 1)
+
+        push = (depth + 1) // 2 * side
+        shift = np.bincount(j, push, n) - np.bincount(i, push, n)
+        pos += np.rint(shift / contacts).astype(np.int64)
+
+        approaching = (speed[i] - speed[j]) * side > 0
+        i, j = i[approaching], j[approaching]
+        exchange = speed[j] - speed[i]
+        impulse = np.bincount(i, exchange, n) - np.bincount(j, exchange, n)
+        speed += np.rint(impulse / contacts).astype(np.int64)
+
+    np.clip(x, 0, width - w, out=x)
+    np.clip(y, 0, height - h, out=y)
+    return len(a)
+
+
+def _collide_list(x, y, dx, dy, w, h, width, height) -> int:
+    a, b = _find_pairs_list(x, y, w, h)
+    for i, j in zip(a, b):
+        ox = min(x[i] + w[i], x[j] + w[j]) - max(x[i], x[j])
+        oy = min(y[i] + h[i], y[j] + h[j]) - max(y[i], y[j])
+        if ox <= 0 or oy <= 0:
+            continue  # already pushed apart by an earlier pair
+
+        pos, speed, depth = (x, dx, ox) if ox <= oy else (y, dy, oy)
+        side = 1 if pos[j] >= pos[i] else -1
+        push = (depth + 1) // 2 * side
+        pos[i] -= push
+        pos[j] += push
+        if (speed[i] - speed[j]) * side > 0:
+            speed[i], speed[j] = speed[j], speed[i]
+
+    for i in range(len(x)):
+        x[i] = min(max(x[i], 0), width - w[i])
+        y[i] = min(max(y[i], 0), height - h[i])
+    return len(a)
+
+
+def collide_pokemons(pokemons: list) -> int:
+    # the same stage for pokemons that aren't in a swarm, knocked out ones stay put
+    moving = [p for p in pokemons if p.hp > 0]
+    if len(moving) < 2:
+        return 0
+
+    columns = [
+        [p.x for p in moving],
+        [p.y for p in moving],
+        [p.dx for p in moving],
+        [p.dy for p in moving],
+        [p.size[0] for p in moving],
+        [p.size[1] for p in moving],
+    ]
+    if np is not None:
+        columns = [np.array(column, dtype=np.int64) for column in columns]
+
+    pairs = collide(*columns)
+    x, y, dx, dy, _, _ = columns
+    for i, p in enumerate(moving):
+        p.x, p.y, p.dx, p.dy = int(x[i]), int(y[i]), int(dx[i]), int(dy[i])
+    return pairs
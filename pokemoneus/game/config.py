@@ -2,6 +2,17 @@ SCREEN_WIDTH = 1000
 SCREEN_HEIGHT = 800
 FPS = 60
 
+# the simulation runs in fixed ticks, independent of how fast frames are drawn
+TICK_RATE = 60
+# simulation speeds to cycle through with TAB, None runs as many ticks as fit in a frame
+SPEEDS = (1, 4, 16, None)
+
+# decode every sprite on a worker thread behind a loading screen at startup
+PRELOAD_ASSETS = True
+
+# redraw and push only the parts of the screen that changed since the last frame
+DIRTY_RECTS = True
+
 BASE_POKEMON_SIZE = (75, 75)
 MAX_ATK = 20
 MAX_DF = 10
@@ -9,6 +20,32 @@ MAX_DF = 10
 BAR_HEIGHT = 6
 
 POKEMONS_PER_TEAM = 5
+BOT_BOX_SIZE = 30
+
+# the expert bot searches lineups against the player's team for at most this long,
+# or this many lineups, whichever comes first
+COUNTER_PICK_BUDGET_MS = 50
+COUNTER_PICK_MAX_NODES = 20_000
+
+# fights and expert picks remembered by the teams' stats, see game.outcomes
+OUTCOME_CACHE_SIZE = 100_000
+
+# a world holds at most this many pokemons, spawning more recycles the oldest
+MAX_WORLD_POKEMONS = 3000
+# released pokemons kept for reuse, per pokemon type
+POOL_LIMIT = 1024
+
+# move world pokemons with the numpy swarm engine when numpy is installed
+USE_SWARM = True
+# the box, both trainers and their wins are kept here between runs
+SAVE_FILE = "save.bin"
+
+# the last battle is recorded here for replay.py, None turns recording off
+REPLAY_FILE = "last_battle.pkr"
+
+# world pokemons bounce off each other, not only off the screen edges. the stage
+# runs every tick, so 16x speed pays for it 16 times a frame and drops ticks sooner
+COLLISIONS = True
 
 COLOR_BG_MENU = (37, 36, 34)
 COLOR_TEXT_TITLE = (224, 165, 66)
@@ -17,6 +54,7 @@ COLOR_TEXT_SECONDARY = (200, 210, 220)
 
 COLOR_WORLD_BG = (5, 140, 66)
 COLOR_PANEL = (37, 36, 34)
+COLOR_HOVER = (255, 255, 255)
 
 COLOR_BG_BATTLE = (37, 36, 34)
 COLOR_DIVIDER = (180, 180, 200)
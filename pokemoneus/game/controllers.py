@@ -1,22 +1,341 @@
 import os
+import queue
+import threading
+from abc import ABC, abstractmethod
+from time import perf_counter
+from typing import Optional
 
+import game.savefile as savefile
 import game.states as states
 import pygame
+from game.config import (
+    COLOR_TEXT_PRIMARY,
+    FPS,
+    PRELOAD_ASSETS,
+    SAVE_FILE,
+    SPEEDS,
+    TICK_RATE,
+)
+from game.lru import LRUCache
+from game.pokemons import PokemonPool, Trainer
+from game.profiler import FrameProfiler
 
+TEXTURE_CACHE_SIZE = 128
+TEXT_CACHE_SIZE = 256
+BAR_CACHE_SIZE = 512
 
-class VisualManager:
+IMAGES_DIR = os.path.join("assets", "images")
+ATLAS_SIZE = (2048, 1024)
+
+# past this many changed regions a full redraw is cheaper than patching
+DIRTY_RECT_LIMIT = 48
+
+PROFILER_TOGGLE_KEY = pygame.K_F3
+PROFILER_DUMP_KEY = pygame.K_F4
+PROFILER_CSV = "profile.csv"
+
+SPEED_KEY = pygame.K_TAB
+TICK_MS = 1000 / TICK_RATE
+# after a long stall (window drag, loading) the simulation doesn't try to catch up
+MAX_FRAME_MS = 250
+# share of a frame the unbounded speed may spend on ticks
+UNBOUNDED_BUDGET = 0.75 / FPS
+# no frame runs more ticks than this, whatever the speed
+MAX_TICKS_PER_FRAME = 64
+
+
+class SpriteAtlas:
+    # sprites of assets/images packed into one sheet as they are first used, so a
+    # frame's blits read from one surface; sprites are subsurfaces of the sheet.
+    # it only keeps where they are, caching the surfaces is up to the caller
+    def __init__(self, directory: str = IMAGES_DIR, size: tuple = ATLAS_SIZE):
+        self.directory = directory
+        self.sheet = pygame.Surface(size, pygame.SRCALPHA).convert_alpha()
+        self.sheet.fill((0, 0, 0, 0))
+        self.regions: dict[tuple, tuple] = {}
+        self._sources: dict[str, pygame.Surface] = {}
+        # shelf packing: sprites go left to right, a new shelf starts below
+        self._shelf_x = self._shelf_y = self._shelf_h = 0
+
+    def source(self, filename: str) -> pygame.Surface:
+        im = self._sources.get(filename)
+        if im is None:
+            # only when the file wasn't preloaded by an AssetLoader
+            path = os.path.join(self.directory, filename)
+            im = self._sources[filename] = pygame.image.load(path).convert_alpha()
+        return im
+
+    def add_source(self, filename: str, im: pygame.Surface) -> None:
+        if filename not in self._sources:
+            self._sources[filename] = im.convert_alpha()
+
+    def get(self, filename: str, size: tuple) -> pygame.Surface:
+        # only what is drawn gets decoded, the menu doesn't wait for every sprite
+        size = tuple(size)
+        region = self.regions.get((filename, size))
+        if region is None:
+            return self._pack(filename, size)
+        return self.sheet.subsurface(region)
+
+    def _pack(self, filename: str, size: tuple) -> pygame.Surface:
+        scaled = pygame.transform.scale(self.source(filename), size)
+        w, h = size
+        sheet_w, sheet_h = self.sheet.get_size()
+        if self._shelf_x + w > sheet_w:
+            self._shelf_x, self._shelf_y = 0, self._shelf_y + self._shelf_h
+            self._shelf_h = 0
+
+        if w > sheet_w or self._shelf_y + h > sheet_h:
+            # doesn't fit anymore, stays a standalone surface
+            return scaled
+
+        pos = (self._shelf_x, self._shelf_y)
+        # adding onto the transparent sheet copies the pixels exactly
+        self.sheet.blit(scaled, pos, special_flags=pygame.BLEND_RGBA_ADD)
+        region = self.regions[(filename, size)] = (*pos, w, h)
+        self._shelf_x += w
+        self._shelf_h = max(self._shelf_h, h)
+        return self.sheet.subsurface(region)
+
+
+class AssetLoader:
+    # decodes every image of the atlas directory on a worker thread. converting
+    # needs the display, so poll() finishes the decoded ones on the main thread
+    def __init__(self, atlas: SpriteAtlas) -> None:
+        self.atlas = atlas
+        self.files = sorted(
+            name for name in os.listdir(atlas.directory) if name.endswith(".png")
+        )
+        self.loaded = 0
+        self.errors: list[tuple[str, Exception]] = []
+        self._decoded: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._decode, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _decode(self) -> None:
+        for name in self.files:
+            try:
+                im = pygame.image.load(os.path.join(self.atlas.directory, name))
+            except Exception as e:  # reported through poll, not lost with the thread
+                self._decoded.put((name, e))
+            else:
+                self._decoded.put((name, im))
+
+    def poll(self) -> None:
+        while True:
+            try:
+                name, im = self._decoded.get_nowait()
+            except queue.Empty:
+                return
+
+            if isinstance(im, Exception):
+                self.errors.append((name, im))
+            else:
+                self.atlas.add_source(name, im)
+            self.loaded += 1
+
+    @property
+    def progress(self) -> float:
+        return self.loaded / len(self.files) if self.files else 1.0
+
+    @property
+    def done(self) -> bool:
+        return self.loaded == len(self.files)
+
+
+class BaseVisualManager(ABC):
+    # what the game needs from a rendering backend, states and entities only
+    # go through this
+    size: tuple[int, int]
+
+    @abstractmethod
+    def load_image(self, filename: str, size: tuple):
+        pass
+
+    @abstractmethod
+    def draw_image(self, pos: tuple[int, int], im) -> None:
+        pass
+
+    @abstractmethod
+    def draw_line(self, start: tuple[int, int], end: tuple[int, int], color, width):
+        pass
+
+    @abstractmethod
+    def draw_circle(self, pos: tuple[int, int], color, radius: int) -> None:
+        pass
+
+    @abstractmethod
+    def draw_rectangle(
+        self, pos: tuple[int, int], width: int, height: int, color, border: int = 0
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def draw_bar(
+        self,
+        topleft: tuple[int, int],
+        width: int,
+        height: int,
+        color,
+        value: int,
+        max_value: int = 100,
+    ):
+        pass
+
+    def draw_hp_bar(
+        self,
+        topleft: tuple[int, int],
+        width: int,
+        height: int,
+        hp: int,
+        max_hp: int = 100,
+    ) -> None:
+        hp = max(0, min(hp, max_hp))
+        ratio = 0 if max_hp <= 0 else hp / max_hp
+        fill_color = (255 - int(255 * ratio), int(255 * ratio), 0)
+
+        self.draw_bar(topleft, width, height, fill_color, hp, max_hp)
+
+    @abstractmethod
+    def get_text_size(self, text: str, font_size=24):
+        pass
+
+    @abstractmethod
+    def draw_text(self, pos: tuple[int, int], text: str, color, font_size=24):
+        pass
+
+    @abstractmethod
+    def clear_screen(self, color: tuple = (0, 0, 0)) -> None:
+        pass
+
+    @abstractmethod
+    def update_screen(self) -> None:
+        pass
+
+    @abstractmethod
+    def events(self) -> list:
+        pass
+
+    @abstractmethod
+    def post(self, event: pygame.event.Event) -> None:
+        pass
+
+    @abstractmethod
+    def key_pressed(self, key: int) -> bool:
+        pass
+
+    @abstractmethod
+    def mouse_pos(self) -> tuple[int, int]:
+        pass
+
+    def preload(self) -> Optional[AssetLoader]:
+        # a started loader for backends that have images to decode
+        return None
+
+    def set_static(self, static: bool) -> None:
+        # the next frame is mostly the same as the last one, backends that can
+        # patch the screen instead of redrawing it may switch to doing so
+        pass
+
+
+class VisualManager(BaseVisualManager):
     def __init__(
-        self, screen_size: tuple = (500, 500), caption: str = "Noname"
+        self,
+        screen_size: tuple = (500, 500),
+        caption: str = "Noname",
+        dirty_rects: bool = False,
     ) -> None:
         pygame.init()
         self.screen = pygame.display.set_mode(screen_size)
         pygame.display.set_caption(caption)
         self.clock = pygame.time.Clock()
 
-    def draw_line(self, start: tuple[int, int], end: tuple[int, int], color, width):
+        # sprites are never drawn onto, so one surface can be shared by every
+        # pokemon; this is the only cache of them, the atlas keeps regions
+        self.textures = LRUCache(TEXTURE_CACHE_SIZE)
+        self.fonts: dict[int, pygame.font.Font] = {}
+        self.texts = LRUCache(TEXT_CACHE_SIZE)
+        self.bars = LRUCache(BAR_CACHE_SIZE)
+        self.atlas = SpriteAtlas()
+
+        # outside of dirty rect mode image draws are queued and sent to the screen
+        # in one Surface.blits call, right before anything else is drawn
+        self._batch: list = []
+
+        # in dirty rect mode draw calls are recorded as (rect, op, args) and the
+        # frame is diffed against the previous one in update_screen. it's only
+        # on while the game says the screen is static, see set_static
+        self.allow_dirty_rects = dirty_rects
+        self.dirty_rects = dirty_rects
+        self._commands: list = []
+        self._previous: Optional[list] = None
+        self._background = (0, 0, 0)
+        self._previous_background = None
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.screen.get_size()
+
+    def events(self) -> list:
+        return pygame.event.get()
+
+    def post(self, event: pygame.event.Event) -> None:
+        pygame.event.post(event)
+
+    def key_pressed(self, key: int) -> bool:
+        return pygame.key.get_pressed()[key]
+
+    def mouse_pos(self) -> tuple[int, int]:
+        return pygame.mouse.get_pos()
+
+    def preload(self) -> AssetLoader:
+        loader = AssetLoader(self.atlas)
+        loader.start()
+        return loader
+
+    def set_static(self, static: bool) -> None:
+        # moving sprites change most of the screen every frame, recording and
+        # diffing them would only end in a full redraw anyway
+        dirty_rects = self.allow_dirty_rects and static
+        if dirty_rects != self.dirty_rects:
+            self.dirty_rects = dirty_rects
+            # whatever is on the screen now wasn't recorded, start over
+            self._commands, self._previous = [], None
+
+    def _submit(self, rect: pygame.Rect, op, *args) -> None:
+        if self.dirty_rects:
+            self._commands.append((rect, op, args))
+        else:
+            self.flush()
+            op(*args)
+
+    def flush(self) -> None:
+        if self._batch:
+            self.screen.blits(self._batch, doreturn=False)
+            self._batch.clear()
+
+    def _replay(self, commands: list, area: Optional[pygame.Rect] = None) -> None:
+        # op None is an image, runs of them go out as one blits call
+        batch = []
+        for rect, op, args in commands:
+            if area is not None and not rect.colliderect(area):
+                continue
+            if op is None:
+                batch.append(args)
+                continue
+            if batch:
+                self.screen.blits(batch, doreturn=False)
+                batch = []
+            op(*args)
+        if batch:
+            self.screen.blits(batch, doreturn=False)
+
+    def _line(self, start, end, color, width) -> None:
         pygame.draw.line(self.screen, color, start, end, width)
 
-    def draw_circle(self, pos: tuple[int, int], color, radius: int) -> None:
+    def _circle(self, pos, color, radius) -> None:
         if len(color) == 4:
             d = radius * 2
             surf = pygame.Surface((d, d), pygame.SRCALPHA)
@@ -25,10 +344,27 @@ class VisualManager:
         else:
             pygame.draw.circle(self.screen, color, pos, radius)
 
+    def _rect(self, rect, color, border) -> None:
+        pygame.draw.rect(self.screen, color, rect, border)
+
+    def draw_line(self, start: tuple[int, int], end: tuple[int, int], color, width):
+        rect = pygame.Rect(
+            min(start[0], end[0]),
+            min(start[1], end[1]),
+            abs(start[0] - end[0]) + 1,
+            abs(start[1] - end[1]) + 1,
+        ).inflate(width * 2, width * 2)
+        self._submit(rect, self._line, tuple(start), tuple(end), tuple(color), width)
+
+    def draw_circle(self, pos: tuple[int, int], color, radius: int) -> None:
+        rect = pygame.Rect(pos[0] - radius, pos[1] - radius, radius * 2, radius * 2)
+        self._submit(rect, self._circle, tuple(pos), tuple(color), radius)
+
     def draw_rectangle(
-        self, pos: tuple[int, int], width: int, height: int, color
+        self, pos: tuple[int, int], width: int, height: int, color, border: int = 0
     ) -> None:
-        pygame.draw.rect(self.screen, color, pygame.Rect(*pos, width, height))
+        rect = pygame.Rect(*pos, width, height)
+        self._submit(rect, self._rect, tuple(rect), tuple(color), border)
 
     def draw_bar(
         self,
@@ -43,9 +379,205 @@ class VisualManager:
         ratio = 0 if max_value <= 0 else value / max_value
         fill_w = int(width * ratio)
 
-        self.draw_rectangle(topleft, width, height, (60, 60, 60))
-        if fill_w > 0:
-            self.draw_rectangle(topleft, fill_w, height, color)
+        # bars come from pre-built strips, a blit instead of two rect draws
+        key = (width, height, tuple(color), fill_w)
+        strip = self.bars.get(key)
+        if strip is None:
+            strip = pygame.Surface((width, height)).convert()
+            strip.fill((60, 60, 60))
+            if fill_w > 0:
+                strip.fill(color, (0, 0, fill_w, height))
+            self.bars.put(key, strip)
+
+        self.draw_image(topleft, strip)
+
+    def load_image(self, filename: str, size: tuple):
+        key = (filename, tuple(size))
+        im = self.textures.get(key)
+        if im is None:
+            im = self.atlas.get(filename, size)
+            self.textures.put(key, im)
+
+        return im
+
+    def draw_image(self, pos: tuple[int, int], im) -> None:
+        if self.dirty_rects:
+            pos = (int(pos[0]), int(pos[1]))
+            self._commands.append((im.get_rect(topleft=pos), None, (im, pos)))
+        else:
+            self._batch.append((im, pos))
+
+    def update_screen(self) -> None:
+        if not self.dirty_rects:
+            self.flush()
+            pygame.display.flip()
+            return
+
+        commands, previous = self._commands, self._previous
+        self._commands, self._previous = [], commands
+
+        background = self._background
+        if previous is None or background != self._previous_background:
+            self._previous_background = background
+            self._redraw(commands)
+            return
+
+        dirty = self._changed_rects(previous, commands)
+        if dirty is None:
+            self._redraw(commands)
+            return
+
+        screen_rect = self.screen.get_rect()
+        for rect in dirty:
+            self.screen.set_clip(rect)
+            self.screen.fill(background, rect)
+            self._replay(commands, rect)
+        self.screen.set_clip(None)
+
+        if dirty:
+            pygame.display.update([rect.clip(screen_rect) for rect in dirty])
+
+    def _redraw(self, commands: list) -> None:
+        self.screen.fill(self._background)
+        self._replay(commands)
+        pygame.display.flip()
+
+    def _changed_rects(self, previous: list, commands: list) -> Optional[list]:
+        # None means "redraw everything"
+        old = [(op, args) for _, op, args in previous]
+        new = [(op, args) for _, op, args in commands]
+        if old == new:
+            return []
+
+        old_keys, new_keys = set(old), set(new)
+        dirty = [rect for rect, op, args in previous if (op, args) not in new_keys]
+        dirty += [rect for rect, op, args in commands if (op, args) not in old_keys]
+        # same calls in a different order change overlaps in unknown places
+        if not dirty or len(dirty) > DIRTY_RECT_LIMIT:
+            return None
+
+        merged: list[pygame.Rect] = []
+        for rect in dirty:
+            for i, other in enumerate(merged):
+                if other.colliderect(rect):
+                    merged[i] = other.union(rect)
+                    break
+            else:
+                merged.append(rect)
+
+        return merged
+
+    def clear_screen(self, color: tuple = (0, 0, 0)) -> None:
+        if self.dirty_rects:
+            # the fill happens in update_screen, only under changed regions
+            self._commands.clear()
+            self._background = tuple(color)
+        else:
+            self._batch.clear()
+            self.screen.fill(color)
+
+    def get_font(self, font_size: int) -> pygame.font.Font:
+        font = self.fonts.get(font_size)
+        if font is None:
+            font = self.fonts[font_size] = pygame.font.Font(None, font_size)
+
+        return font
+
+    def render_text(self, text: str, color, font_size=24, antialias=True):
+        key = (text, font_size, tuple(color), antialias)
+        text_surface = self.texts.get(key)
+        if text_surface is None:
+            font = self.get_font(font_size)
+            text_surface = font.render(text, antialias, color)
+            self.texts.put(key, text_surface)
+
+        return text_surface
+
+    def get_text_size(self, text: str, font_size=24):
+        # pooled font measures without rasterising; matches the rendered surface
+        return self.get_font(font_size).size(text)
+
+    def draw_text(self, pos: tuple[int, int], text: str, color, font_size=24):
+        text_surface = self.render_text(text, color, font_size)
+        self.draw_image(pos, text_surface)
+
+        return text_surface.get_size()
+
+
+class NullImage:
+    # stands in for a surface when nothing is drawn, only the size is real
+    __slots__ = ("size",)
+
+    def __init__(self, size: tuple) -> None:
+        self.size = (int(size[0]), int(size[1]))
+
+    def get_size(self) -> tuple[int, int]:
+        return self.size
+
+    def get_width(self) -> int:
+        return self.size[0]
+
+    def get_height(self) -> int:
+        return self.size[1]
+
+    def get_rect(self, **kwargs) -> pygame.Rect:
+        rect = pygame.Rect((0, 0), self.size)
+        for name, value in kwargs.items():
+            setattr(rect, name, value)
+        return rect
+
+
+class NullClock:
+    def tick(self, framerate: int = 0) -> int:
+        return 0
+
+    def get_fps(self) -> float:
+        return 0.0
+
+
+class NullVisualManager(BaseVisualManager):
+    # no window and no pygame.init: images are size-only stubs and draws do
+    # nothing, for running the game logic as fast as it goes
+    def __init__(self, screen_size: tuple = (500, 500), caption: str = "Noname"):
+        self.size = (int(screen_size[0]), int(screen_size[1]))
+        self.clock = NullClock()
+        self.images: dict[tuple, NullImage] = {}
+
+        self._events: list = []
+        self.pressed: set[int] = set()
+        self.mouse = (0, 0)
+
+    def load_image(self, filename: str, size: tuple) -> NullImage:
+        key = (filename, tuple(size))
+        im = self.images.get(key)
+        if im is None:
+            im = self.images[key] = NullImage(size)
+        return im
+
+    def draw_image(self, pos: tuple[int, int], im) -> None:
+        pass
+
+    def draw_line(self, start: tuple[int, int], end: tuple[int, int], color, width):
+        pass
+
+    def draw_circle(self, pos: tuple[int, int], color, radius: int) -> None:
+        pass
+
+    def draw_rectangle(
+        self, pos: tuple[int, int], width: int, height: int, color, border: int = 0
+    ) -> None:
+        pass
+
+    def draw_bar(
+        self,
+        topleft: tuple[int, int],
+        width: int,
+        height: int,
+        color,
+        value: int,
+        max_value: int = 100,
+    ):
+        pass
 
     def draw_hp_bar(
         self,
@@ -55,55 +587,68 @@ class VisualManager:
         hp: int,
         max_hp: int = 100,
     ) -> None:
-        hp = max(0, min(hp, max_hp))
-        ratio = 0 if max_hp <= 0 else hp / max_hp
-        fill_color = (255 - int(255 * ratio), int(255 * ratio), 0)
+        pass
 
-        self.draw_bar(topleft, width, height, fill_color, hp, max_hp)
+    def get_text_size(self, text: str, font_size=24):
+        # roughly what the default font gives, layouts only need a plausible box
+        return (len(text) * font_size // 2, font_size * 3 // 4)
 
-    def load_image(self, filename: str, size: tuple):
-        path = os.path.join("assets", "images", filename)
-        im = pygame.image.load(path).convert_alpha()
-        return pygame.transform.scale(im, size)
+    def draw_text(self, pos: tuple[int, int], text: str, color, font_size=24):
+        return self.get_text_size(text, font_size)
 
-    def draw_image(self, pos: tuple[int, int], im) -> None:
-        self.screen.blit(im, pos)
+    def clear_screen(self, color: tuple = (0, 0, 0)) -> None:
+        pass
 
     def update_screen(self) -> None:
-        pygame.display.flip()
+        pass
 
-    def clear_screen(self, color: tuple = (0, 0, 0)) -> None:
-        self.screen.fill(color)
+    def events(self) -> list:
+        events, self._events = self._events, []
+        return events
 
-    def get_text_size(self, text: str, font_size=24):
-        font = pygame.font.Font(None, font_size)
-        text_surface = font.render(text, True, (0, 0, 0))
+    def post(self, event: pygame.event.Event) -> None:
+        self._events.append(event)
 
-        return text_surface.get_size()
+    def key_pressed(self, key: int) -> bool:
+        return key in self.pressed
 
-    def draw_text(self, pos: tuple[int, int], text: str, color, font_size=24):
-        font = pygame.font.Font(None, font_size)
-        text_surface = font.render(text, True, color)
-        self.screen.blit(text_surface, pos)
+    def mouse_pos(self) -> tuple[int, int]:
+        return self.mouse
 
-        return text_surface.get_size()
+
+STATE_TYPES = {
+    "loading": states.LoadingState,
+    "menu": states.MainMenuState,
+    "collect": states.CollectingPokemonsState,
+    "battle": states.BattleState,
+    "fps": states.FpsStateState,
+}
 
 
 class GameManager:
-    def __init__(self, vm: VisualManager):
+    def __init__(self, vm: BaseVisualManager, preload: bool = PRELOAD_ASSETS):
         self.vm = vm
         self.running = True
 
         self.box = []
+        self.pool = PokemonPool()
+        self.profiler = FrameProfiler()
+
+        # simulated milliseconds, battles are paced by this instead of wall time
+        self.sim_time = 0.0
+        self.speed = 0
+        # how far drawing is between the last two ticks
+        self.alpha = 1.0
+        self._accumulator = 0.0
+        self._last_update = perf_counter()
 
-        self._states = {
-            "menu": states.MainMenuState(self),
-            "collect": states.CollectingPokemonsState(self),
-            "battle": states.BattleState(self),
-            "fps": states.FpsStateState(self),
-        }
+        # states are built the first time they are entered and kept afterwards
+        self._states = {}
+        # trainers from a save file, the battle state takes them once it's built
+        self.saved_trainers: Optional[tuple] = None
 
-        self.state = "menu"
+        self.loader: Optional[AssetLoader] = vm.preload() if preload else None
+        self.state = "menu" if self.loader is None else "loading"
 
     @property
     def state(self):
@@ -111,19 +656,157 @@ class GameManager:
 
     @state.setter
     def state(self, other: str):
-        self._current_state = self._states[other]
+        self.state_name = other
+        self._current_state = self.get_state(other)
         self._current_state.enter()
 
+    def get_state(self, name: str):
+        state = self._states.get(name)
+        if state is None:
+            state = self._states[name] = STATE_TYPES[name](self)
+        return state
+
+    def trainers(self) -> tuple:
+        battle = self._states.get("battle")
+        if battle is not None:
+            return battle.trainer1, battle.trainer2
+        return self.saved_trainers or (Trainer(), Trainer())
+
+    def save(self, path: str = SAVE_FILE) -> None:
+        trainer1, trainer2 = self.trainers()
+        # every battle fills the trainers' boxes anew, only their wins last
+        savefile.write(
+            path,
+            {
+                "box": savefile.SavedBox(None, 0, self.box),
+                "trainer1": savefile.SavedBox(None, trainer1.wins, []),
+                "trainer2": savefile.SavedBox(
+                    savefile.trainer_kind(trainer2), trainer2.wins, []
+                ),
+            },
+        )
+
+    def load(self, path: str = SAVE_FILE) -> None:
+        # pokemons are only built once something touches them
+        saved = savefile.read(path, vm=self.vm)
+        self.box = saved["box"].box
+        self.saved_trainers = (
+            savefile.trainer_from_saved(saved["trainer1"]),
+            savefile.trainer_from_saved(saved["trainer2"]),
+        )
+        battle = self._states.get("battle")
+        if battle is not None:
+            battle.trainer1, battle.trainer2 = self.saved_trainers
+
+    @property
+    def speed_factor(self):
+        return SPEEDS[self.speed]
+
+    def cycle_speed(self):
+        self.speed = (self.speed + 1) % len(SPEEDS)
+        self._accumulator = 0.0
+
+    def toggle_profiler(self):
+        self.profiler.clear()
+        self.profiler.enabled = not self.profiler.enabled
+
     def handle_events(self):
-        for event in pygame.event.get():
+        if self.profiler.enabled:
+            self.profiler.call("handle_events", self._handle_events)
+        else:
+            self._handle_events()
+
+    def _handle_events(self):
+        profiler = self.profiler
+        for event in self.vm.events():
             if event.type == pygame.QUIT:
                 self.running = False
                 return
 
-            self.state.handle_event(event)
+            if event.type == pygame.KEYDOWN:
+                if event.key == PROFILER_TOGGLE_KEY:
+                    self.toggle_profiler()
+                    continue
+                if event.key == PROFILER_DUMP_KEY and profiler.frames:
+                    profiler.dump_csv(PROFILER_CSV)
+                    continue
+                if event.key == SPEED_KEY:
+                    self.cycle_speed()
+                    continue
+
+            if profiler.enabled:
+                section = f"{self.state_name}.handle_event"
+                profiler.call(section, self.state.handle_event, event)
+            else:
+                self.state.handle_event(event)
+
+    def tick(self):
+        # the state's own share of the update phase, over all ticks of the frame
+        if self.profiler.enabled:
+            self.profiler.call(f"{self.state_name}.update", self.state.update)
+        else:
+            self.state.update()
+        self.sim_time += TICK_MS
 
     def update(self):
-        self.state.update()
+        if self.profiler.enabled:
+            self.profiler.call("update", self._update)
+        else:
+            self._update()
+
+    def _update(self):
+        now = perf_counter()
+        elapsed = min((now - self._last_update) * 1000, MAX_FRAME_MS)
+        self._last_update = now
+
+        speed = self.speed_factor if self.state.simulated else 1
+        if speed is None:
+            deadline = now + UNBOUNDED_BUDGET
+            self.tick()
+            ticks = 1
+            while ticks < MAX_TICKS_PER_FRAME and perf_counter() < deadline:
+                self.tick()
+                ticks += 1
+            self.alpha = 1.0
+            return
+
+        self._accumulator += elapsed * speed
+        ticks = 0
+        while self._accumulator >= TICK_MS and ticks < MAX_TICKS_PER_FRAME:
+            self.tick()
+            self._accumulator -= TICK_MS
+            ticks += 1
+        # ticks that didn't fit are dropped, not carried into the next frame
+        self._accumulator = min(self._accumulator, TICK_MS)
+        self.alpha = self._accumulator / TICK_MS
 
     def draw(self):
-        self.state.draw()
+        if self.profiler.enabled:
+            self.profiler.call("draw", self._draw)
+        else:
+            self._draw()
+
+    def _draw(self):
+        self.vm.set_static(self.state.static)
+        if self.profiler.enabled:
+            self.profiler.call(f"{self.state_name}.draw", self.state.draw)
+        else:
+            self.state.draw()
+
+        if self.state.simulated and self.speed_factor != 1:
+            speed = "max" if self.speed_factor is None else f"{self.speed_factor}x"
+            text = f"Speed: {speed}"
+            tw, th = self.vm.get_text_size(text, font_size=20)
+            w, h = self.vm.size
+            self.vm.draw_text((w - tw - 16, h - th - 16), text, COLOR_TEXT_PRIMARY, 20)
+
+    def update_screen(self):
+        profiler = self.profiler
+        if not profiler.enabled:
+            self.vm.update_screen()
+            return
+
+        height = self.vm.size[1]
+        profiler.call("overlay", profiler.draw, self.vm, (10, height - 110))
+        profiler.call("update_screen", self.vm.update_screen)
+        profiler.end_frame()
@@ -0,0 +1,50 @@
+try:
+    import numpy as np
+except ImportError:  # damage_batch falls back to plain lists
+    np = None
+
+NORMAL, ELECTRIC, FIRE, GRASS, WATER = range(5)
+TYPE_COUNT = 5
+
+# attacker type, defender type -> (attack multiplier, defense numerator, defense
+# denominator), damage is max(1, atk * mul - df * num // den)
+SPECIAL_MODIFIERS = {
+    (WATER, FIRE): (3, 1, 1),  # water triples its attack against fire
+    (GRASS, FIRE): (1, 1, 2),  # grass halves fire's defense
+    (ELECTRIC, WATER): (1, 0, 1),  # electric ignores water's defense
+}
+
+MODIFIERS = tuple(
+    tuple(SPECIAL_MODIFIERS.get((a, d), (1, 1, 1)) for d in range(TYPE_COUNT))
+    for a in range(TYPE_COUNT)
+)
+
+
+def raw_damage(attacker_type: int, atk: int, defender_type: int, df: int) -> int:
+    mul, num, den = MODIFIERS[attacker_type][defender_type]
+    return max(1, atk * mul - df * num // den)
+
+
+def damage(attacker, defender) -> int:
+    mul, num, den = MODIFIERS[attacker.type_id][defender.type_id]
+    return max(1, attacker.atk * mul - defender.df * num // den)
+
+
+if np is not None:
+    _TABLE = np.array(MODIFIERS, dtype=np.int64)
+    _MUL, _NUM, _DEN = _TABLE[..., 0], _TABLE[..., 1], _TABLE[..., 2]
+
+
+def damage_batch(attacker_types, atk, defender_types, df):
+    # one damage value per matchup, arrays in and out when numpy is installed
+    if np is None:
+        return [
+            raw_damage(a, at, d, de)
+            for a, at, d, de in zip(attacker_types, atk, defender_types, df)
+        ]
+
+    a = np.asarray(attacker_types, dtype=np.int64)
+    d = np.asarray(defender_types, dtype=np.int64)
+    atk = np.asarray(atk, dtype=np.int64)
+    df = np.asarray(df, dtype=np.int64)
+    return np.maximum(1, atk * _MUL[a, d] - df * _NUM[a, d] // _DEN[a, d])
@@ -0,0 +1,276 @@
+import random
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from game import outcomes
+from game.config import BOT_BOX_SIZE, POKEMONS_PER_TEAM
+from game.pokemons import TRAINER_TYPES, fill_random_box
+from game.simulation import SWAPPED_WINNER, play_trainers
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+
+
+class Entrant(NamedTuple):
+    id: int
+    policy: str  # one of TRAINER_TYPES
+    seed: int  # the box is drawn from this, so workers can rebuild it
+
+    @property
+    def name(self) -> str:
+        return f"{self.policy}#{self.id}"
+
+
+class MatchResult(NamedTuple):
+    first: int  # entrant ids
+    second: int
+    first_wins: int
+    second_wins: int
+    draws: int
+
+    @property
+    def score(self) -> float:
+        # share of the points the first entrant took, what elo works with
+        games = self.first_wins + self.second_wins + self.draws
+        if not games:
+            return 0.5
+        return (self.first_wins + self.draws / 2) / games
+
+
+class Standing(NamedTuple):
+    entrant: Entrant
+    rating: float
+    played: int
+    wins: int
+    losses: int
+    draws: int
+
+    @property
+    def points(self) -> float:
+        return self.wins + self.draws / 2
+
+
+def expected_score(rating: float, other: float) -> float:
+    return 1 / (1 + 10 ** ((other - rating) / 400))
+
+
+def make_entrants(count: int, policies: Iterable[str], seed: int = 0) -> list:
+    # policies take turns, so every one of them gets the same number of boxes
+    policies = list(policies)
+    rng = random.Random(f"{seed}:entrants")
+    return [
+        Entrant(i, policies[i % len(policies)], rng.getrandbits(63))
+        for i in range(count)
+    ]
+
+
+# every entrant's pokemons and their starting hp, built once per process
+_boxes: Dict[Tuple[Entrant, int], Tuple[list, list]] = {}
+
+
+def entrant_box(entrant: Entrant, box_size: int = BOT_BOX_SIZE) -> Tuple[list, list]:
+    key = (entrant, box_size)
+    box = _boxes.get(key)
+    if box is None:
+        trainer = TRAINER_TYPES[entrant.policy]()
+        fill_random_box(
+            trainer, box_size, prefix=f"E{entrant.id}_", rng=random.Random(entrant.seed)
+        )
+        box = _boxes[key] = (trainer.box, [p.hp for p in trainer.box])
+    return box
+
+
+def entrant_trainer(entrant: Entrant, box_size: int = BOT_BOX_SIZE):
+    # a new box list over the shared pokemons, the battle takes its team out of it
+    trainer = TRAINER_TYPES[entrant.policy]()
+    trainer.box = list(entrant_box(entrant, box_size)[0])
+    return trainer
+
+
+def play_game(
+    player: Entrant,
+    bot: Entrant,
+    box_size: int = BOT_BOX_SIZE,
+    team_size: int = POKEMONS_PER_TEAM,
+    cached: bool = False,
+) -> int:
+    winner = play_trainers(
+        entrant_trainer(player, box_size),
+        entrant_trainer(bot, box_size),
+        team_size,
+        cached,
+    )
+
+    # hits only change hp, putting it back makes the pokemons good for the next game
+    for entrant in (player, bot):
+        pokemons, hps = entrant_box(entrant, box_size)
+        for p, hp in zip(pokemons, hps):
+            p.hp = hp
+    return winner
+
+
+def play_match(
+    first: Entrant,
+    second: Entrant,
+    box_size: int = BOT_BOX_SIZE,
+    team_size: int = POKEMONS_PER_TEAM,
+    cached: bool = False,
+) -> MatchResult:
+    # one game on each side
+    wins = [0, 0, 0]
+    wins[play_game(first, second, box_size, team_size, cached)] += 1
+    wins[SWAPPED_WINNER[play_game(second, first, box_size, team_size, cached)]] += 1
+    return MatchResult(first.id, second.id, wins[1], wins[2], wins[0])
+
+
+def play_shard(
+    task: tuple,
+) -> Tuple[List[MatchResult], outcomes.Report, outcomes.Known]:
+    # results plus how the process' outcome caches did and what they learned
+    pairs, box_size, team_size, cached = task
+    before = outcomes.stats()
+    results = [play_match(a, b, box_size, team_size, cached) for a, b in pairs]
+    return results, outcomes.stats_since(before), outcomes.take_new()
+
+
+def bounded_map(executor, fn, tasks: Iterable, in_flight: int) -> Iterator:
+    # executor.map that takes tasks as results come back, instead of submitting
+    # all of them up front
+    pending: deque = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def round_robin(entrants: list) -> Iterator[list]:
+    # circle method: everybody meets everybody once over n - 1 rounds, an odd
+    # field gets a bye slot
+    players: List[Optional[Entrant]] = list(entrants)
+    if len(players) % 2:
+        players.append(None)
+    n = len(players)
+
+    for _ in range(n - 1):
+        pairs = []
+        for i in range(n // 2):
+            a, b = players[i], players[n - 1 - i]
+            if a is not None and b is not None:
+                pairs.append((a, b))
+        yield pairs
+        players.insert(1, players.pop())
+
+
+class League:
+    def __init__(
+        self,
+        entrants: list,
+        k: float = K_FACTOR,
+        box_size: int = BOT_BOX_SIZE,
+        team_size: int = POKEMONS_PER_TEAM,
+        cached: bool = False,
+    ) -> None:
+        self.entrants = {e.id: e for e in entrants}
+        self.k = k
+        self.box_size = box_size
+        self.team_size = team_size
+        # see simulation.play_trainers
+        self.cached = cached
+
+        self.ratings = {e.id: INITIAL_RATING for e in entrants}
+        # wins, losses, draws in matches
+        self.records = {e.id: [0, 0, 0] for e in entrants}
+        self.met: set = set()
+        self.matches = 0
+        # battle outcome and expert pick lookups
+        self.cache_stats = (outcomes.CacheStats(), outcomes.CacheStats())
+
+    def record(self, result: MatchResult) -> None:
+        # ratings move after every match, in the order the pairings were made,
+        # so they don't depend on the number of workers
+        a, b = result.first, result.second
+        ra, rb = self.ratings[a], self.ratings[b]
+        change = self.k * (result.score - expected_score(ra, rb))
+        self.ratings[a] = ra + change
+        self.ratings[b] = rb - change
+
+        if result.first_wins > result.second_wins:
+            self.records[a][0] += 1
+            self.records[b][1] += 1
+        elif result.second_wins > result.first_wins:
+            self.records[a][1] += 1
+            self.records[b][0] += 1
+        else:
+            self.records[a][2] += 1
+            self.records[b][2] += 1
+
+        self.met.add((min(a, b), max(a, b)))
+        self.matches += 1
+
+    def play(
+        self,
+        pairs: Iterable[tuple],
+        executor=None,
+        shard_size: int = 256,
+        in_flight: int = 8,
+    ) -> Iterator[List[MatchResult]]:
+        # pairs are cut into shards for the executor as it gets to them, with at
+        # most in_flight shards queued; results come back and are recorded shard
+        # by shard, in order
+        tasks = self.shards(pairs, shard_size)
+        results = (
+            map(play_shard, tasks)
+            if executor is None
+            else bounded_map(executor, play_shard, tasks, in_flight)
+        )
+        for shard_results, shard_cache, learned in results:
+            self.cache_stats = outcomes.merge_reports(self.cache_stats, shard_cache)
+            outcomes.update(learned)
+            for result in shard_results:
+                self.record(result)
+            yield shard_results
+
+    def shards(self, pairs: Iterable[tuple], shard_size: int) -> Iterator[tuple]:
+        shard: list = []
+        for pair in pairs:
+            shard.append(pair)
+            if len(shard) == shard_size:
+                yield (shard, self.box_size, self.team_size, self.cached)
+                shard = []
+        if shard:
+            yield (shard, self.box_size, self.team_size, self.cached)
+
+    def swiss_pairs(self) -> list:
+        # neighbours in the standings meet, skipping rematches where possible;
+        # the last one left over sits the round out
+        waiting = [s.entrant for s in reversed(self.standings())]
+        pairs = []
+        while len(waiting) > 1:
+            a = waiting.pop()
+            for i in range(len(waiting) - 1, -1, -1):
+                b = waiting[i]
+                if (min(a.id, b.id), max(a.id, b.id)) not in self.met:
+                    break
+            else:
+                i = len(waiting) - 1
+            pairs.append((a, waiting.pop(i)))
+        return pairs
+
+    def standings(self, top: Optional[int] = None) -> List[Standing]:
+        table = [
+            Standing(entrant, self.ratings[i], sum(self.records[i]), *self.records[i])
+            for i, entrant in self.entrants.items()
+        ]
+        table.sort(key=lambda s: (-s.points, -s.rating, s.entrant.id))
+        return table[:top] if top is not None else table
+
+    def policy_ratings(self) -> Dict[str, float]:
+        # average rating of every policy's entrants
+        totals: Dict[str, list] = {}
+        for i, entrant in self.entrants.items():
+            total = totals.setdefault(entrant.policy, [0.0, 0])
+            total[0] += self.ratings[i]
+            total[1] += 1
+        return {policy: s / n for policy, (s, n) in totals.items()}
@@ -0,0 +1,339 @@
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from game.battle import Stats, duel, pokemon_stats, team_stats
+from game.config import COUNTER_PICK_BUDGET_MS, COUNTER_PICK_MAX_NODES
+from game.damage import raw_damage
+from game.outcomes import pick_key
+
+
+class _OutOfBudget(Exception):
+    pass
+
+
+def _dominates(a: Stats, b: Stats) -> bool:
+    # a is at least as good as b in every stat, so it can stand in for b anywhere
+    return a[0] == b[0] and a[1] >= b[1] and a[2] >= b[2] and a[3] >= b[3]
+
+
+class _Search:
+    # branch and bound over ordered lineups against a known opponent lineup that
+    # strikes first. a state is (opponent index, its hp, whether our next pokemon
+    # strikes first); what a pokemon does from a state never depends on the rest
+    # of the lineup, so outcomes are computed once per state and kind
+    def __init__(self, them: List[Stats], kinds: List[Stats], n: int) -> None:
+        self.them = them
+        self.kinds = kinds
+        self.n = n
+        self.damage = [self.damage_row(stats) for stats in kinds]
+        # kinds every kind can stand in for
+        self.dominated = [
+            [o for o, other in enumerate(kinds) if o != k and _dominates(stats, other)]
+            for k, stats in enumerate(kinds)
+        ]
+        # sub-battle outcomes: (opponent index, its hp, strikes first) -> what
+        # every kind does from there, and the bound below it
+        self.states: Dict[tuple, list] = {}
+        self.bounds: Dict[tuple, tuple] = {}
+        self.chains: Dict[tuple, tuple] = {}
+        self.deadline = float("inf")
+
+    def damage_row(self, mine: Stats) -> list:
+        # (damage dealt, damage taken) against every pokemon of the opponent
+        return [
+            (
+                raw_damage(mine[0], mine[1], other[0], other[2]),
+                raw_damage(other[0], other[1], mine[0], mine[2]),
+            )
+            for other in self.them
+        ]
+
+    def fight(self, damage: list, own: int, i: int, hp: int, first: bool) -> tuple:
+        # (opponent index, its hp, our hp) after our pokemon fought as far as it
+        # could; index == len(them) means the opponent is out of pokemons
+        them = self.them
+        while i < len(them):
+            dealt, taken = damage[i]
+            if first:
+                won, _, left = duel(dealt, own, taken, hp)
+            else:
+                lost, _, left = duel(taken, hp, dealt, own)
+                won = not lost
+            if not won:
+                return i, left, 0
+
+            own = left
+            i += 1
+            hp = them[i][3] if i < len(them) else 0
+            # the opponent's next pokemon comes in and strikes first
+            first = False
+        return i, 0, own
+
+    def advance(self, k: int, i: int, hp: int, first: bool) -> tuple:
+        # fight() for a kind: after its first knock out the rest only depends on
+        # its hp and who comes next, which many states share
+        damage = self.damage[k]
+        own = self.kinds[k][3]
+        dealt, taken = damage[i]
+        if first:
+            won, _, left = duel(dealt, own, taken, hp)
+        else:
+            lost, _, left = duel(taken, hp, dealt, own)
+            won = not lost
+        if not won:
+            return i, left, 0
+
+        i += 1
+        if i == len(self.them):
+            return i, 0, left
+        key = (k, i, left)
+        rest = self.chains.get(key)
+        if rest is None:
+            rest = self.chains[key] = self.fight(
+                damage, left, i, self.them[i][3], False
+            )
+        return rest
+
+    def children(self, state: tuple) -> list:
+        # [(outcome, kinds with that outcome)], the best outcomes first; kinds
+        # come weakest first, so within an outcome they do too
+        children = self.states.get(state)
+        if children is not None:
+            return children
+
+        if perf_counter() > self.deadline:
+            raise _OutOfBudget
+        groups: Dict[tuple, list] = {}
+        for k in range(len(self.kinds)):
+            groups.setdefault(self.advance(k, *state), []).append(k)
+
+        children = sorted(
+            groups.items(), key=lambda child: self.value(child[0], 0), reverse=True
+        )
+        self.states[state] = children
+        return children
+
+    def value(self, outcome: tuple, used: int) -> tuple:
+        # wins beat losses, fewer pokemons spent and more hp left beat more;
+        # a loss is better the further into the opponent's lineup it got
+        i, hp, own = outcome
+        if i == len(self.them):
+            return (1, -used, own)
+        return (0, i, -hp)
+
+    def bound(self, state: tuple, slots: int) -> tuple:
+        # the best value reachable with at most `slots` more pokemons if every
+        # kind could be used any number of times, counting only pokemons used
+        # from here on; never below what the real box can do
+        key = (state, slots)
+        best = self.bounds.get(key)
+        if best is not None:
+            return best
+
+        for outcome, _ in self.children(state):
+            i, hp, own = outcome
+            if i == len(self.them):
+                value = (1, -1, own)
+            elif slots == 1:
+                value = (0, i, -hp)
+            else:
+                value = self.bound((i, hp, True), slots - 1)
+                if value[0]:
+                    value = (1, value[1] - 1, value[2])
+            if best is None or value > best:
+                best = value
+
+        self.bounds[key] = best
+        return best
+
+    def run(
+        self, counts: List[int], deadline: float, max_nodes: int, best=None
+    ) -> Tuple[tuple, list]:
+        self.counts = counts
+        self.left = sum(counts)
+        self.deadline = deadline
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.best = best
+        # whether the whole tree was searched, so the best lineup is the best there is
+        self.finished = False
+        try:
+            self.dive((0, self.them[0][3], False))
+            self.visit((0, self.them[0][3], False), [])
+            self.finished = True
+        except _OutOfBudget:
+            pass
+        return self.best
+
+    def dive(self, state: tuple) -> None:
+        # greedy lineup first, the best outcome for every next place, so a search
+        # cut short by the budget still has something good to return
+        counts = list(self.counts)
+        left = self.left
+        lineup: list = []
+        while True:
+            for outcome, members in self.children(state):
+                k = next((k for k in members if counts[k]), None)
+                if k is not None:
+                    break
+            else:
+                return
+            lineup.append(k)
+            counts[k] -= 1
+            left -= 1
+            value = self.value(outcome, len(lineup))
+            if value[0] or len(lineup) == self.n or not left:
+                if self.best is None or value > self.best[0]:
+                    self.best = (value, lineup)
+                return
+            state = (outcome[0], outcome[1], True)
+
+    def visit(self, state: tuple, lineup: list) -> None:
+        self.nodes += 1
+        if self.nodes >= self.max_nodes or perf_counter() > self.deadline:
+            raise _OutOfBudget
+
+        counts = self.counts
+        used = len(lineup) + 1
+        for outcome, members in self.children(state):
+            i, hp, _ = outcome
+            if self.best is not None and i < len(self.them) and used < self.n:
+                # nothing below this outcome can beat the best lineup so far
+                value = self.bound((i, hp, True), self.n - used)
+                if value[0]:
+                    value = (1, value[1] - used, value[2])
+                if value <= self.best[0]:
+                    continue
+
+            group = set(members) if len(members) > 1 else ()
+            for k in members:
+                # a pokemon at least as strong as another one with the same
+                # outcome here is better kept for later
+                if not counts[k] or any(
+                    counts[o] and o in group for o in self.dominated[k]
+                ):
+                    continue
+
+                lineup.append(k)
+                value = self.value(outcome, used)
+                if value[0] or used == self.n or self.left == 1:
+                    if self.best is None or value > self.best[0]:
+                        self.best = (value, list(lineup))
+                else:
+                    counts[k] -= 1
+                    self.left -= 1
+                    self.visit((i, hp, True), lineup)
+                    counts[k] += 1
+                    self.left += 1
+                lineup.pop()
+
+
+def _useful_kinds(groups: Dict[Stats, list], n: int) -> List[Stats]:
+    # a lineup has n places, so a kind with n pokemons at least as strong as it
+    # is never needed: one of them is always free to take its place
+    kinds = sorted(groups, key=lambda k: -sum(k[1:]))
+    useful = []
+    for k, stats in enumerate(kinds):
+        stronger = 0
+        for other in kinds[:k]:
+            if _dominates(other, stats):
+                stronger += len(groups[other])
+                if stronger >= n:
+                    break
+        if stronger < n:
+            useful.append(stats)
+    # weakest first, the order branches try them in
+    useful.reverse()
+    return useful
+
+
+def counter_pick(
+    box: Sequence,
+    opponent: Sequence,
+    n: int,
+    fallback: Optional[list] = None,
+    budget_ms: float = COUNTER_PICK_BUDGET_MS,
+    max_nodes: int = COUNTER_PICK_MAX_NODES,
+    cache=None,
+) -> Optional[list]:
+    # the ordered lineup of at most n pokemons from the box that does best against
+    # the opponent's lineup, which strikes first. it can be shorter than n when
+    # the fight is won before the rest would come in. the search stops after
+    # max_nodes lineups or budget_ms, whichever comes first, with the best one so
+    # far; the fallback lineup is kept unless something beats it. with a cache
+    # (an OutcomeCache) a box that already met this lineup skips the search;
+    # only searches that finished are kept, a budget cut isn't for good
+    them = team_stats(opponent)
+    if not them or n <= 0:
+        return None
+    deadline = perf_counter() + budget_ms / 1000
+
+    # pokemons with the same stats are interchangeable, branches go over kinds
+    groups: Dict[Stats, list] = {}
+    for p in box:
+        if p.hp > 0:
+            groups.setdefault(pokemon_stats(p), []).append(p)
+    if not groups:
+        return None
+
+    key = None
+    if cache is not None:
+        key = pick_key(team_stats(p for p in box if p.hp > 0), them, n)
+    if key is not None:
+        lineup = cache.get(key)
+        if lineup is not None:
+            # the lineup's stats one after another, () for no lineup
+            kinds = [tuple(lineup[i : i + 4]) for i in range(0, len(lineup), 4)]
+            try:
+                return _take(groups, kinds) if kinds else None
+            except (KeyError, IndexError):
+                pass  # not from this box after all, searched again
+
+    team, finished = _pick(groups, them, n, fallback, deadline, max_nodes)
+    if key is not None and finished:
+        cache.put(key, tuple(v for p in team_stats(team or ()) for v in p))
+    return team
+
+
+def _take(groups: Dict[Stats, list], lineup: Sequence[Stats]) -> list:
+    # pokemons for a lineup of kinds, the first ones of every kind
+    taken: Dict[Stats, int] = {}
+    team = []
+    for stats in lineup:
+        team.append(groups[stats][taken.get(stats, 0)])
+        taken[stats] = taken.get(stats, 0) + 1
+    return team
+
+
+def _pick(
+    groups: Dict[Stats, list],
+    them: List[Stats],
+    n: int,
+    fallback: Optional[list],
+    deadline: float,
+    max_nodes: int,
+) -> Tuple[Optional[list], bool]:
+    # the lineup and whether the search got through all of them
+    kinds = _useful_kinds(groups, n)
+
+    search = _Search(them, kinds, n)
+    seeded = best = None
+    if fallback and all(p.hp > 0 for p in fallback):
+        state = (0, them[0][3], False)
+        for used, p in enumerate(fallback, 1):
+            row = search.damage_row(pokemon_stats(p))
+            outcome = search.fight(row, p.hp, *state)
+            state = (outcome[0], outcome[1], True)
+            if outcome[0] == len(them):
+                break
+        seeded = best = (search.value(outcome, used), fallback[:used])
+
+    # no lineup has more than n pokemons of one kind
+    counts = [min(len(groups[k]), n) for k in kinds]
+    best = search.run(counts, deadline, max_nodes, best)
+    if best is None:
+        return None, search.finished
+    if best is seeded:
+        return best[1], search.finished
+
+    return _take(groups, [kinds[k] for k in best[1]]), search.finished
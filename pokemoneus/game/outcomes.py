@@ -0,0 +1,237 @@
+import os
+import struct
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+from game.battle import Stats, resolve_stats
+from game.config import OUTCOME_CACHE_SIZE
+from game.lru import LRUCache
+
+MAGIC = b"PKOC"
+VERSION = 2
+
+# magic, version, battle outcomes, expert picks
+HEADER = struct.Struct("<4sHII")
+# key size in bytes, value size in shorts; the key and the shorts follow
+ENTRY = struct.Struct("<HH")
+
+# what resolve_stats gives: winner, turns, the winner's front pokemon and its hp
+Outcome = Tuple[int, int, int, int]
+Entries = Dict[bytes, tuple]
+
+
+class CacheStats(NamedTuple):
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+def merge_cache_stats(a: CacheStats, b: CacheStats) -> CacheStats:
+    return CacheStats(a.hits + b.hits, a.misses + b.misses)
+
+
+def pack_key(prefix: bytes, counts: Sequence[int], values: Sequence[int]):
+    # the counts as unsigned shorts, then the values as signed shorts; None when
+    # stats past a short can't be packed, such a fight or pick isn't cached
+    try:
+        return prefix + struct.pack(f"<{len(counts)}H{len(values)}h", *counts, *values)
+    except struct.error:
+        return None
+
+
+def signature(player: Sequence[Stats], bot: Sequence[Stats]):
+    # both teams in order, four signed shorts per pokemon; names, positions and
+    # trainers don't change how a fight goes
+    flat = [v for p in player for v in p]
+    flat += [v for p in bot for v in p]
+    return pack_key(b"", (len(player),), flat)
+
+
+def pick_key(box: Sequence[Stats], them: Sequence[Stats], n: int):
+    # the box in stat order, since which pokemon of a kind goes makes no
+    # difference; the prefix keeps picks apart from battle signatures
+    flat = [v for p in them for v in p]
+    flat += [v for p in sorted(box) for v in p]
+    return pack_key(b"pick", (n, len(them)), flat)
+
+
+class OutcomeCache(LRUCache):
+    # signatures to tuples of small ints
+    def __init__(self, maxsize: int = OUTCOME_CACHE_SIZE) -> None:
+        super().__init__(maxsize)
+        # entries computed here since the last take_new, for workers to hand
+        # back to the process that saves the cache
+        self.track = False
+        self._new: Entries = {}
+
+    def resolve(self, player: Sequence[Stats], bot: Sequence[Stats]) -> Outcome:
+        # resolve_stats in front of the cache, for battle outcomes
+        key = signature(player, bot)
+        if key is None:
+            return resolve_stats(player, bot)
+
+        outcome = self.get(key)
+        # an outcome from a file has to fit the teams it is used for
+        if outcome is None or outcome[2] >= len(player if outcome[0] == 1 else bot):
+            outcome = resolve_stats(player, bot)
+            self.put(key, outcome)
+        return outcome
+
+    def put(self, key: bytes, value: tuple) -> None:
+        super().put(key, value)
+        if self.track and len(self._new) < self.maxsize:
+            self._new[key] = value
+
+    def stats(self) -> CacheStats:
+        return CacheStats(self.hits, self.misses)
+
+    def take_new(self) -> Entries:
+        new, self._new = self._new, {}
+        return new
+
+    def entries(self) -> Entries:
+        return dict(self._data)
+
+    def update(self, entries: Entries) -> None:
+        # known entries, not new ones
+        for key, value in entries.items():
+            super().put(key, value)
+
+
+# one of each per process: outcomes of whole battles, and the lineups the
+# expert bot picked, by its box and the lineup it picked against
+battles = OutcomeCache()
+picks = OutcomeCache()
+CACHES = (battles, picks)
+CACHE_NAMES = ("battle outcomes", "expert picks")
+
+# both caches' entries, stats or news, in the order of CACHES
+Known = Tuple[Entries, Entries]
+Report = Tuple[CacheStats, CacheStats]
+
+
+def stats() -> Report:
+    return battles.stats(), picks.stats()
+
+
+def stats_since(before: Report) -> Report:
+    now = stats()
+    return tuple(
+        CacheStats(a.hits - b.hits, a.misses - b.misses) for a, b in zip(now, before)
+    )
+
+
+def merge_reports(a: Report, b: Report) -> Report:
+    return tuple(merge_cache_stats(x, y) for x, y in zip(a, b))
+
+
+def entries() -> Known:
+    return battles.entries(), picks.entries()
+
+
+def take_new() -> Known:
+    return battles.take_new(), picks.take_new()
+
+
+def update(known: Known) -> None:
+    for cache, new in zip(CACHES, known):
+        cache.update(new)
+
+
+def init_worker(known: Known, track: bool = False) -> None:
+    # ProcessPoolExecutor initializer: starts a worker with what the parent knows
+    update(known)
+    for cache in CACHES:
+        cache.track = track
+
+
+def _valid(cache: OutcomeCache, value: tuple) -> bool:
+    if cache is battles:
+        return len(value) == 4 and value[0] in (0, 1, 2) and value[2] >= 0
+    # a lineup, four stats per pokemon
+    return len(value) % 4 == 0
+
+
+def save(path: str) -> None:
+    chunks = []
+    counts = []
+    for cache in CACHES:
+        count = 0
+        for key, value in cache.entries().items():
+            try:
+                entry = ENTRY.pack(len(key), len(value))
+                entry += key + struct.pack(f"<{len(value)}h", *value)
+            except struct.error:
+                continue  # doesn't fit the format, it's computed again next time
+            chunks.append(entry)
+            count += 1
+        counts.append(count)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, *counts))
+        f.write(b"".join(chunks))
+    os.replace(tmp, path)
+
+
+def load(path: str) -> int:
+    # the number of entries loaded; a missing, damaged or older file loads
+    # nothing and leaves the caches as they were
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, *counts = HEADER.unpack_from(data, 0)
+    except (OSError, struct.error):
+        return 0
+    if magic != MAGIC or version != VERSION:
+        return 0
+
+    offset = HEADER.size
+    known = []
+    try:
+        for cache, count in zip(CACHES, counts):
+            found: Entries = {}
+            for _ in range(count):
+                key_size, value_size = ENTRY.unpack_from(data, offset)
+                offset += ENTRY.size
+                key = data[offset : offset + key_size]
+                offset += key_size
+                value = struct.unpack_from(f"<{value_size}h", data, offset)
+                offset += value_size * 2
+                if len(key) != key_size or not _valid(cache, value):
+                    return 0
+                found[key] = value
+            known.append(found)
+    except struct.error:
+        return 0
+
+    update(tuple(known))
+    return sum(len(found) for found in known)
+
+
+def load_known(path: Optional[str], prefix: str = "") -> Known:
+    # what workers start with: every entry known so far, they send back what
+    # they learn; nothing without a cache file
+    if not path:
+        return {}, {}
+    print(f"{prefix}{load(path)} outcomes loaded from {path}")
+    return entries()
+
+
+def save_known(path: Optional[str], report: Report, prefix: str = "") -> None:
+    if not path:
+        return
+    for name, counted in zip(CACHE_NAMES, report):
+        print(
+            f"{prefix}{name}: {counted.hits} hits in {counted.lookups} lookups "
+            f"({counted.hit_rate:.1%})"
+        )
+    save(path)
+    saved = sum(len(cache) for cache in CACHES)
+    print(f"{prefix}{saved} outcomes saved to {path}")
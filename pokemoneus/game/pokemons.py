@@ -1,10 +1,55 @@
+import heapq
 import math
 import random
+from operator import itemgetter
+from typing import Optional
+
+from game.config import (
+    BASE_POKEMON_SIZE,
+    COUNTER_PICK_BUDGET_MS,
+    COUNTER_PICK_MAX_NODES,
+    MAX_ATK,
+    MAX_DF,
+    POOL_LIMIT,
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+)
+from game.damage import ELECTRIC, FIRE, GRASS, NORMAL, WATER, damage
+
+
+class Species:
+    # flyweight with everything pokemons of one type and size have in common
+    __slots__ = ("pokemon_type", "vm", "size", "image")
+
+    def __init__(self, pokemon_type: type, vm, size: tuple[int, int]) -> None:
+        self.pokemon_type = pokemon_type
+        self.vm = vm
+        self.size = size
+
+        # without a visual manager (headless battles) pokemons have no sprite
+        self.image = None
+        if vm is not None:
+            self.image = vm.load_image(pokemon_type.image_file, size)
+
 
-from game.config import BASE_POKEMON_SIZE, MAX_ATK, MAX_DF, SCREEN_HEIGHT, SCREEN_WIDTH
+_species: dict[tuple, Species] = {}
+
+
+def get_species(pokemon_type: type, vm, size: tuple[int, int]) -> Species:
+    key = (pokemon_type, vm, size)
+    species = _species.get(key)
+    if species is None:
+        species = _species[key] = Species(pokemon_type, vm, size)
+    return species
 
 
 class Pokemon:
+    # px, py is where the last move started, for drawing between ticks
+    __slots__ = ("species", "name", "x", "y", "px", "py", "dx", "dy", "hp", "atk", "df")
+
+    image_file = "error.png"
+    type_id = NORMAL
+
     def __init__(
         self,
         name: str,
@@ -16,20 +61,37 @@ class Pokemon:
         df: int = -1,
         hp: int = 100,
         is_bot: bool = False,
+        rng: Optional[random.Random] = None,
     ) -> None:
-        self.vm = vm
+        self.reset(name, pos, vm, size, speed, atk, df, hp, is_bot, rng)
+
+    def reset(
+        self,
+        name: str,
+        pos: tuple[int, int],
+        vm,
+        size: tuple[int, int] = BASE_POKEMON_SIZE,
+        speed: int = 5,
+        atk: int = -1,
+        df: int = -1,
+        hp: int = 100,
+        is_bot: bool = False,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        # everything the constructor does, a pooled pokemon is reused through this
+        self.species = get_species(type(self), vm, tuple(size))
 
-        self.name = name
+        self.name = str(name)
         self.x, self.y = pos
-        self.size = size
+        self.px, self.py = pos
 
-        angle = random.uniform(0, 2 * math.pi)
+        # a seeded stream makes the stats reproducible, global random otherwise
+        rng = rng or random
+        angle = rng.uniform(0, 2 * math.pi)
         self.dx = int(speed * math.cos(angle))
         self.dy = int(speed * math.sin(angle))
 
-        self.image = self.vm.load_image("error.png", size)
-
-        self.hp = hp
+        self.hp = max(0, hp)
 
         _max_atk, _max_df = MAX_ATK, MAX_DF
         if is_bot:
@@ -37,45 +99,26 @@ class Pokemon:
             _max_df *= 0.85
 
         if atk == -1:
-            atk = random.randint(1, int(_max_atk))
+            atk = rng.randint(1, int(_max_atk))
         if df == -1:
-            df = random.randint(1, int(_max_df))
+            df = rng.randint(1, int(_max_df))
 
-        self.atk, self.df = atk, df
+        self.atk, self.df = max(0, atk), max(0, df)
 
     @property
-    def name(self) -> str:
-        return self._name
-
-    @name.setter
-    def name(self, value: str) -> None:
-        self._name = str(value)
+    def vm(self):
+        return self.species.vm
 
     @property
-    def hp(self) -> int:
-        return self._hp
-
-    @hp.setter
-    def hp(self, value: int) -> None:
-        self._hp = max(0, value)
-
-    @property
-    def atk(self) -> int:
-        return self._atk
-
-    @atk.setter
-    def atk(self, value: int) -> None:
-        self._atk = max(0, value)
+    def size(self) -> tuple[int, int]:
+        return self.species.size
 
     @property
-    def df(self) -> int:
-        return self._df
-
-    @df.setter
-    def df(self, value: int) -> None:
-        self._df = max(0, value)
+    def image(self):
+        return self.species.image
 
     def move(self):
+        self.px, self.py = self.x, self.y
         if self.hp == 0:
             return
 
@@ -90,28 +133,36 @@ class Pokemon:
         self.x += self.dx
         self.y += self.dy
 
-    def draw(self, draw_hp_bar: bool = True, draw_stats: bool = True):
+    def draw(
+        self,
+        draw_hp_bar: bool = True,
+        draw_stats: bool = True,
+        pos: Optional[tuple[int, int]] = None,
+    ):
+        species = self.species
+        vm = species.vm
+        x, y = (self.x, self.y) if pos is None else pos
         if draw_hp_bar:
-            self.vm.draw_hp_bar(
-                (self.x, self.y - 8),
+            vm.draw_hp_bar(
+                (x, y - 8),
                 BASE_POKEMON_SIZE[0],
                 6,
                 self.hp,
             )
 
-        self.vm.draw_image((self.x, self.y), self.image)
+        vm.draw_image((x, y), species.image)
 
         if draw_stats:
-            self.vm.draw_bar(
-                (self.x, self.y + BASE_POKEMON_SIZE[1] + 2),
+            vm.draw_bar(
+                (x, y + BASE_POKEMON_SIZE[1] + 2),
                 BASE_POKEMON_SIZE[0],
                 6,
                 (255, 0, 0),
                 self.atk,
                 MAX_ATK,
             )
-            self.vm.draw_bar(
-                (self.x, self.y + BASE_POKEMON_SIZE[1] + 10),
+            vm.draw_bar(
+                (x, y + BASE_POKEMON_SIZE[1] + 10),
                 BASE_POKEMON_SIZE[0],
                 6,
                 (0, 0, 255),
@@ -121,62 +172,35 @@ class Pokemon:
 
     def attack(self, opponent: "Pokemon") -> None:
         if self.hp > 0 and opponent.hp > 0:
-            opponent.hp -= max(1, self.atk - opponent.df)
+            opponent.hp = max(0, opponent.hp - damage(self, opponent))
 
 
 class WaterPokemon(Pokemon):
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-
-        self.image = self.vm.load_image("water_pokemon.png", self.size)
-
-    def attack(self, opponent: Pokemon) -> None:
-        old_atk = self.atk
-        if isinstance(opponent, FirePokemon):
-            self.atk *= 3
+    __slots__ = ()
 
-        super().attack(opponent)
-
-        self.atk = old_atk
+    image_file = "water_pokemon.png"
+    type_id = WATER
 
 
 class FirePokemon(Pokemon):
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
+    __slots__ = ()
 
-        self.image = self.vm.load_image("fire_pokemon.png", self.size)
+    image_file = "fire_pokemon.png"
+    type_id = FIRE
 
 
 class GrassPokemon(Pokemon):
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-
-        self.image = self.vm.load_image("grass_pokemon.png", self.size)
-
-    def attack(self, opponent: Pokemon) -> None:
-        old_df = opponent.df
-        if isinstance(opponent, FirePokemon):
-            opponent.df //= 2
+    __slots__ = ()
 
-        super().attack(opponent)
-
-        opponent.df = old_df
+    image_file = "grass_pokemon.png"
+    type_id = GRASS
 
 
 class ElectricPokemon(Pokemon):
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-
-        self.image = self.vm.load_image("electric_pokemon.png", self.size)
-
-    def attack(self, opponent: Pokemon) -> None:
-        old_df = opponent.df
-        if isinstance(opponent, WaterPokemon):
-            opponent.df = 0
-
-        super().attack(opponent)
+    __slots__ = ()
 
-        opponent.df = old_df
+    image_file = "electric_pokemon.png"
+    type_id = ELECTRIC
 
 
 class Trainer:
@@ -187,46 +211,156 @@ class Trainer:
     def add(self, pokemon: Pokemon) -> None:
         self.box.append(pokemon)
 
-    def best_team(self, n: int) -> list[Pokemon]:
+    def best_team(self, n: int, opponent: Optional[list] = None) -> list[Pokemon]:
+        # opponent is the other side's team when it was picked first
         n = min(n, len(self.box))
         team, self.box = self.box[:n], self.box[n:]
         return team
 
 
+def index_box(box: list[Pokemon], key) -> dict[type, list]:
+    # type -> [(sort key, position in box), pokemon], the position keeps ties
+    # in box order like a stable sort would
+    index: dict[type, list] = {}
+    for i, p in enumerate(box):
+        index.setdefault(type(p), []).append(((key(p), i), p))
+    return index
+
+
+def take_best(candidates: list, n: int) -> list[Pokemon]:
+    return [p for _, p in heapq.nsmallest(n, candidates, key=itemgetter(0))]
+
+
+def without(box: list[Pokemon], team: list[Pokemon]) -> list[Pokemon]:
+    taken = {id(p) for p in team}
+    return [p for p in box if id(p) not in taken]
+
+
 class MediumTrainer(Trainer):
-    def best_team(self, n):
-        sorted_box = sorted(
-            self.box, key=lambda pokemon: pokemon.atk + pokemon.df, reverse=True
+    def best_team(self, n, opponent=None):
+        # partial selection, same pick as a stable sort by atk + df
+        best_team = heapq.nsmallest(
+            n, self.box, key=lambda pokemon: -(pokemon.atk + pokemon.df)
         )
-        best_team = sorted_box[:n]
-        self.box = sorted_box[n:]
+        self.box = without(self.box, best_team)
         return best_team
 
 
 class HardTrainer(Trainer):
-    def sort_pokemons(self) -> None:
-        self.box.sort(key=lambda x: (x.atk + x.df, x.atk, x.df), reverse=True)
-
-    def best_team(self, n: int) -> list:
-        self.sort_pokemons()
+    @staticmethod
+    def strength(x: Pokemon) -> tuple[int, int, int]:
+        return -(x.atk + x.df), -x.atk, -x.df
 
+    def best_team(self, n: int, opponent: Optional[list] = None) -> list:
         non_fire_pokemons = []
         fire_pokemons = []
 
-        for p in self.box:
-            if "fire" in type(p).__name__.lower():
-                fire_pokemons.append(p)
+        # only the n best of every type can make it into the team
+        for pokemon_type, group in index_box(self.box, self.strength).items():
+            best = heapq.nsmallest(n, group, key=itemgetter(0))
+            if issubclass(pokemon_type, FirePokemon):
+                fire_pokemons.extend(best)
             else:
-                non_fire_pokemons.append(p)
+                non_fire_pokemons.extend(best)
+
+        team = take_best(non_fire_pokemons, n)
+        team += take_best(fire_pokemons, n - len(team))
+
+        self.box = without(self.box, team)
+        return team
 
-        team = non_fire_pokemons[:n]
 
-        while len(team) < n:
-            team.append(fire_pokemons[0])
-            del fire_pokemons[0]
+class CounterTrainer(HardTrainer):
+    # searches the lineup that does best against the opponent's known team, the
+    # hard rule is the starting point and the pick when the opponent is unknown
+    budget_ms = COUNTER_PICK_BUDGET_MS
+    max_nodes = COUNTER_PICK_MAX_NODES
+    # an OutcomeCache for the picks, a box that meets the same lineup again
+    # skips the search; simulations with a cache file set it
+    cache = None
 
-        self.box = [pokemon for pokemon in self.box if pokemon not in team]
+    def best_team(self, n: int, opponent: Optional[list] = None) -> list:
+        box = self.box
+        fallback = super().best_team(n)
+        if not opponent:
+            return fallback
+
+        # the search is only loaded once an expert bot picks a team
+        from game.optimizer import counter_pick
+
+        team = counter_pick(
+            box, opponent, n, fallback, self.budget_ms, self.max_nodes, self.cache
+        )
+        if team is None:
+            return fallback
+
+        # the fight is over before the rest comes in, they only fill the team
+        rest = without(box, team)
+        rest.sort(key=self.strength)
+        team += rest[: min(n, len(box)) - len(team)]
+
+        self.box = without(box, team)
         return team
 
 
 POKEMON_TYPES = (ElectricPokemon, FirePokemon, GrassPokemon, WaterPokemon)
+
+TRAINER_TYPES = {
+    "easy": Trainer,
+    "medium": MediumTrainer,
+    "hard": HardTrainer,
+    "expert": CounterTrainer,
+}
+
+
+class PokemonPool:
+    # released pokemons wait here per type and are reset in place instead of
+    # building new ones, at most `limit` of every type are kept
+    def __init__(self, limit: int = POOL_LIMIT) -> None:
+        self.limit = limit
+        self._free: dict[type, list] = {}
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, pokemon_type: type, *args, **kwargs) -> Pokemon:
+        free = self._free.get(pokemon_type)
+        if free:
+            pokemon = free.pop()
+            pokemon.reset(*args, **kwargs)
+            self.reused += 1
+            return pokemon
+
+        self.created += 1
+        return pokemon_type(*args, **kwargs)
+
+    def release(self, pokemon: Pokemon) -> None:
+        free = self._free.setdefault(type(pokemon), [])
+        if len(free) < self.limit:
+            free.append(pokemon)
+
+    def release_all(self, pokemons) -> None:
+        for pokemon in pokemons:
+            self.release(pokemon)
+
+    def __len__(self) -> int:
+        return sum(len(free) for free in self._free.values())
+
+
+def fill_random_box(
+    trainer: Trainer,
+    size: int,
+    vm=None,
+    prefix: str = "T2_",
+    is_bot: bool = True,
+    rng: Optional[random.Random] = None,
+    pool: Optional[PokemonPool] = None,
+) -> None:
+    rng = rng or random
+    while len(trainer.box) < size:
+        P = rng.choice(POKEMON_TYPES)
+        name = f"{prefix}{len(trainer.box)+1}"
+        if pool is not None:
+            pokemon = pool.acquire(P, name, (0, 0), is_bot=is_bot, vm=vm, rng=rng)
+        else:
+            pokemon = P(name, (0, 0), is_bot=is_bot, vm=vm, rng=rng)
+        trainer.add(pokemon)
@@ -0,0 +1,105 @@
+import csv
+from array import array
+from time import perf_counter
+
+PROFILER_FRAMES = 240
+
+# overlay is the graph itself, drawn right before update_screen
+PHASES = ("handle_events", "update", "draw", "overlay", "update_screen")
+PHASE_COLORS = {
+    "handle_events": (220, 220, 80),
+    "update": (80, 200, 240),
+    "draw": (240, 120, 80),
+    "overlay": (120, 120, 120),
+    "update_screen": (170, 110, 230),
+}
+
+
+class FrameProfiler:
+    def __init__(self, size: int = PROFILER_FRAMES) -> None:
+        self.enabled = False
+        self.size = size
+        self.frames = 0
+        # section name -> ring buffer of milliseconds, one slot per frame
+        self.sections: dict[str, array] = {}
+        self._current: dict[str, float] = {}
+
+    def call(self, section: str, fn, *args) -> float:
+        start = perf_counter()
+        fn(*args)
+        ms = (perf_counter() - start) * 1000
+        self.add(section, ms)
+        return ms
+
+    def add(self, section: str, ms: float) -> None:
+        self._current[section] = self._current.get(section, 0.0) + ms
+
+    def end_frame(self) -> None:
+        i = self.frames % self.size
+        current = self._current
+
+        for section in current:
+            if section not in self.sections:
+                self.sections[section] = array("d", bytes(8 * self.size))
+        for section, ring in self.sections.items():
+            ring[i] = current.get(section, 0.0)
+
+        current.clear()
+        self.frames += 1
+
+    def recorded(self) -> range:
+        # ring indices from the oldest to the newest frame
+        count = min(self.frames, self.size)
+        start = self.frames - count
+        return range(start, self.frames)
+
+    def history(self, section: str) -> list[float]:
+        ring = self.sections.get(section)
+        if ring is None:
+            return []
+        return [ring[frame % self.size] for frame in self.recorded()]
+
+    def frame_times(self) -> list[float]:
+        columns = [self.history(phase) for phase in PHASES]
+        return [sum(values) for values in zip(*columns)]
+
+    def clear(self) -> None:
+        self.frames = 0
+        self.sections.clear()
+        self._current.clear()
+
+    def dump_csv(self, path: str) -> None:
+        names = list(self.sections)
+        columns = [self.history(name) for name in names]
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", *names])
+            for frame, values in zip(self.recorded(), zip(*columns)):
+                writer.writerow([frame, *(f"{v:.4f}" for v in values)])
+
+    def draw(self, vm, pos: tuple[int, int], height: int = 100, budget_ms=1000 / 60):
+        x0, y0 = pos
+        width = self.size
+        vm.draw_rectangle((x0, y0), width, height, (20, 20, 20))
+
+        # the target frame time sits at half of the graph height
+        scale = height / (budget_ms * 2)
+        for x, frame in enumerate(self.recorded(), start=x0):
+            i = frame % self.size
+            bottom = y0 + height
+            for phase in PHASES:
+                ring = self.sections.get(phase)
+                if ring is None:
+                    continue
+                top = max(y0, bottom - int(ring[i] * scale))
+                if top < bottom:
+                    vm.draw_line((x, bottom), (x, top), PHASE_COLORS[phase], 1)
+                bottom = top
+
+        budget_y = y0 + height - int(budget_ms * scale)
+        vm.draw_line((x0, budget_y), (x0 + width, budget_y), (255, 255, 255), 1)
+
+        times = self.frame_times()
+        if times:
+            text = f"frame {times[-1]:.1f} ms  max {max(times):.1f} ms"
+            vm.draw_text((x0 + 4, y0 + 4), text, (255, 255, 255), 18)
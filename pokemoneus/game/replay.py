@@ -0,0 +1,189 @@
+import gzip
+import struct
+from typing import List, NamedTuple, Optional, Tuple
+
+from game.battle import Battle, BattleResult
+from game.pokemons import Trainer
+from game.savefile import KINDS, TYPES_BY_ID, trainer_kind
+
+MAGIC = b"PKRP"
+VERSION = 1
+
+# magic, version, team size, player kind, bot kind (indices in KINDS), seed
+HEADER = struct.Struct("<4sBBBBQ")
+# roster size of a side, then one entry per pokemon followed by its utf-8 name
+ROSTER = struct.Struct("<H")
+ENTRY = struct.Struct("<BHHHH")  # type id, atk, df, hp, name length
+# tag, side, damage, hp after the hit / turns for the result
+EVENT = struct.Struct("<BBHI")
+
+HIT, KNOCK_OUT, RESULT = 1, 2, 3
+
+# (type_id, atk, df, hp, name)
+Entry = Tuple[int, int, int, int, str]
+Event = Tuple[int, int, int, int]
+
+
+class ReplayError(Exception):
+    pass
+
+
+class Recording(NamedTuple):
+    seed: int
+    team_size: int
+    player_kind: Optional[str]
+    bot_kind: Optional[str]
+    player_team: List[Entry]
+    bot_team: List[Entry]
+    events: List[Event]
+
+    @property
+    def result(self) -> Optional[BattleResult]:
+        for tag, side, _, turns in reversed(self.events):
+            if tag == RESULT:
+                return BattleResult(side, turns, [])
+        return None
+
+
+class BattleRecorder:
+    # streams a battle to a gzip file as it is played, pass it to Battle
+    def __init__(self, path: str, seed: int = 0) -> None:
+        self.path = path
+        self.seed = seed
+        self.file = None
+
+    def start(self, battle: Battle) -> None:
+        self.close()
+        self.file = gzip.open(self.path, "wb")
+        self.file.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                battle.n,
+                KINDS.index(trainer_kind(battle.player_trainer)),
+                KINDS.index(trainer_kind(battle.bot_trainer)),
+                self.seed,
+            )
+        )
+        for team in (battle.player_team, battle.bot_team):
+            self.file.write(ROSTER.pack(len(team)))
+            for p in team:
+                name = p.name.encode()
+                self.file.write(ENTRY.pack(p.type_id, p.atk, p.df, p.hp, len(name)))
+                self.file.write(name)
+
+    def hit(self, side: int, damage: int, hp: int) -> None:
+        if self.file is None:
+            return
+        self.file.write(EVENT.pack(HIT, side, damage, hp))
+        if hp <= 0:
+            self.file.write(EVENT.pack(KNOCK_OUT, 3 - side, 0, 0))
+
+    def finish(self, result: BattleResult) -> None:
+        if self.file is None:
+            return
+        self.file.write(EVENT.pack(RESULT, result.winner, 0, result.turns))
+        self.close()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class _EventLog:
+    # collects the same events as BattleRecorder, for comparing a replay
+    def __init__(self) -> None:
+        self.events: List[Event] = []
+
+    def start(self, battle: Battle) -> None:
+        self.events = []
+
+    def hit(self, side: int, damage: int, hp: int) -> None:
+        self.events.append((HIT, side, damage, hp))
+        if hp <= 0:
+            self.events.append((KNOCK_OUT, 3 - side, 0, 0))
+
+    def finish(self, result: BattleResult) -> None:
+        self.events.append((RESULT, result.winner, 0, result.turns))
+
+
+def _read(f, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ReplayError("replay file ends too early")
+    return data
+
+
+def read(path: str) -> Recording:
+    with gzip.open(path, "rb") as f:
+        magic, version, team_size, player_kind, bot_kind, seed = HEADER.unpack(
+            _read(f, HEADER.size)
+        )
+        if magic != MAGIC:
+            raise ReplayError(f"{path} is not a battle replay")
+        if version != VERSION:
+            raise ReplayError(f"{path} has unsupported replay version {version}")
+
+        teams = []
+        for _ in range(2):
+            (count,) = ROSTER.unpack(_read(f, ROSTER.size))
+            team = []
+            for _ in range(count):
+                type_id, atk, df, hp, size = ENTRY.unpack(_read(f, ENTRY.size))
+                team.append((type_id, atk, df, hp, _read(f, size).decode()))
+            teams.append(team)
+
+        data = bytearray()
+        try:
+            while True:
+                chunk = f.read(1 << 16)
+                if not chunk:
+                    break
+                data += chunk
+        except EOFError:
+            pass  # the battle was left before it ended, keep what got written
+
+    del data[len(data) - len(data) % EVENT.size :]
+    events = list(EVENT.iter_unpack(data))
+
+    return Recording(
+        seed, team_size, KINDS[player_kind], KINDS[bot_kind], *teams, events
+    )
+
+
+def trainers_from_recording(recording: Recording, vm=None) -> Tuple[Trainer, Trainer]:
+    # plain trainers whose boxes are exactly the recorded teams, so best_team
+    # hands them out unchanged
+    trainers = []
+    for team in (recording.player_team, recording.bot_team):
+        trainer = Trainer()
+        for type_id, atk, df, hp, name in team:
+            P = TYPES_BY_ID[type_id]
+            trainer.add(P(name, (0, 0), vm, atk=atk, df=df, hp=hp))
+        trainers.append(trainer)
+    return trainers[0], trainers[1]
+
+
+def replay(recording: Recording, verify: bool = True) -> BattleResult:
+    # re-runs the battle without a clock, as fast as the cpu goes
+    log = _EventLog()
+    battle = Battle(recording.team_size, clock=None)
+    battle.recorder = log if verify else None
+    battle.start(*trainers_from_recording(recording))
+    result = battle.run()
+
+    events = log.events
+    if recording.result is None:
+        # an unfinished recording is checked as far as it goes
+        events = events[: len(recording.events)]
+
+    if verify and events != recording.events:
+        for i, (got, expected) in enumerate(zip(events, recording.events)):
+            if got != expected:
+                break
+        else:
+            i = min(len(events), len(recording.events))
+        raise ReplayError(f"replay diverges from the recording at event {i}")
+
+    return result
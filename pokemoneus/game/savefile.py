@@ -0,0 +1,279 @@
+import mmap
+import os
+import struct
+import sys
+import weakref
+from array import array
+from collections.abc import MutableSequence
+from typing import NamedTuple, Optional
+
+from game.pokemons import POKEMON_TYPES, TRAINER_TYPES, Pokemon, Trainer
+
+MAGIC = b"PKMN"
+VERSION = 1
+
+# magic, version, number of boxes, names offset, names size
+HEADER = struct.Struct("<4sHHQQ")
+# box name, trainer kind (index in KINDS, 0 for none), wins, records offset, count
+BOX = struct.Struct("<16sBxxxIQI")
+# type id, atk, df, hp, name offset
+RECORD = struct.Struct("<BxHHHI")
+# names are stored once each, as a length and the utf-8 bytes
+NAME_LENGTH = struct.Struct("<H")
+
+KINDS = (None, *TRAINER_TYPES)
+TYPES_BY_ID = {p.type_id: p for p in (Pokemon, *POKEMON_TYPES)}
+
+
+class SaveError(Exception):
+    pass
+
+
+class SavedBox(NamedTuple):
+    kind: Optional[str]  # one of TRAINER_TYPES, None for the player's boxes
+    wins: int
+    box: list
+
+
+class Mapping:
+    # owns the mmap of a save file, every LazyBox read from it goes through this
+    def __init__(self, path: str) -> None:
+        self.path = os.path.abspath(path)
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _mappings.add(self)
+
+    def detach(self) -> None:
+        # copies the file into memory and closes the map, so the file can be
+        # replaced (windows won't while it's mapped) and lazy boxes keep working
+        mapped = self.buffer
+        if isinstance(mapped, mmap.mmap):
+            self.buffer = bytes(mapped)
+            mapped.close()
+
+
+# every mapping still alive, write() detaches the ones of the file it replaces
+_mappings: "weakref.WeakSet[Mapping]" = weakref.WeakSet()
+
+
+class LazyBox(MutableSequence):
+    # a box read from a save file: entries stay record indices into the mapped
+    # file until they are used, then they're built into pokemons once
+    def __init__(
+        self,
+        source: Mapping,
+        offset: int,
+        names_offset: int,
+        names_size: int,
+        count: int,
+        vm=None,
+    ):
+        self.source = source
+        self.offset = offset
+        self.names_offset = names_offset
+        self.names_size = names_size
+        self.vm = vm
+        self._items: list = list(range(count))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _build(self, i: int) -> Pokemon:
+        item = self._items[i]
+        if isinstance(item, int):
+            item = self._items[i] = self.pokemon(item)
+        return item
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            # slices share the mapped records, nothing gets built yet
+            box = LazyBox(
+                self.source,
+                self.offset,
+                self.names_offset,
+                self.names_size,
+                0,
+                self.vm,
+            )
+            box._items = self._items[i]
+            return box
+        if i < 0:
+            i += len(self._items)
+        if not 0 <= i < len(self._items):
+            raise IndexError("box index out of range")
+        return self._build(i)
+
+    def __setitem__(self, i, value) -> None:
+        self._items[i] = value
+
+    def __delitem__(self, i) -> None:
+        del self._items[i]
+
+    def insert(self, i: int, value) -> None:
+        self._items.insert(i, value)
+
+    def __iter__(self):
+        for i in range(len(self._items)):
+            yield self._build(i)
+
+    def __add__(self, other) -> list:
+        return list(self) + list(other)
+
+    def __radd__(self, other) -> list:
+        return list(other) + list(self)
+
+    def record(self, index: int) -> tuple:
+        return RECORD.unpack_from(self.source.buffer, self.offset + index * RECORD.size)
+
+    def name(self, offset: int) -> str:
+        # read() checked that the length is inside the names, a length or bytes
+        # that are off only spoil the name
+        buffer = self.source.buffer
+        start = self.names_offset + offset
+        (size,) = NAME_LENGTH.unpack_from(buffer, start)
+        start += NAME_LENGTH.size
+        end = min(start + size, self.names_offset + self.names_size)
+        return bytes(buffer[start:end]).decode(errors="replace")
+
+    def pokemon(self, index: int) -> Pokemon:
+        type_id, atk, df, hp, name = self.record(index)
+        pokemon_type = TYPES_BY_ID[type_id]
+        return pokemon_type(self.name(name), (0, 0), self.vm, atk=atk, df=df, hp=hp)
+
+
+def trainer_kind(trainer) -> Optional[str]:
+    for kind, trainer_type in TRAINER_TYPES.items():
+        if type(trainer) is trainer_type:
+            return kind
+    return None
+
+
+def trainer_from_saved(saved: SavedBox):
+    trainer = TRAINER_TYPES[saved.kind]() if saved.kind else Trainer()
+    trainer.wins, trainer.box = saved.wins, saved.box
+    return trainer
+
+
+def _rows(box) -> list:
+    # (type id, atk, df, hp, name) for every entry of the box
+    if not isinstance(box, LazyBox):
+        return [(p.type_id, p.atk, p.df, p.hp, p.name) for p in box]
+
+    # records that were never built are copied over without making a pokemon
+    names: dict[int, str] = {}
+    rows = []
+    for item in box._items:
+        if isinstance(item, int):
+            type_id, atk, df, hp, offset = box.record(item)
+            name = names.get(offset)
+            if name is None:
+                name = names[offset] = box.name(offset)
+            rows.append((type_id, atk, df, hp, name))
+        else:
+            rows.append((item.type_id, item.atk, item.df, item.hp, item.name))
+    return rows
+
+
+def write(path: str, boxes: dict[str, SavedBox]) -> None:
+    entries = []
+    rows = []
+    for box_name, saved in boxes.items():
+        entries.append((box_name, saved, len(rows) * RECORD.size, len(saved.box)))
+        rows += _rows(saved.box)
+
+    # every name is stored once, records point at it
+    names = dict.fromkeys(row[4] for row in rows)
+    encoded = [name.encode() for name in names]
+    offset = 0
+    for name, data in zip(names, encoded):
+        names[name] = offset
+        offset += NAME_LENGTH.size + len(data)
+    names_blob = b"".join([NAME_LENGTH.pack(len(data)) + data for data in encoded])
+
+    pack = RECORD.pack
+    records = b"".join(
+        [pack(t, atk, df, hp, names[name]) for t, atk, df, hp, name in rows]
+    )
+
+    records_start = HEADER.size + BOX.size * len(entries)
+    names_start = records_start + len(records)
+
+    header = HEADER.pack(MAGIC, VERSION, len(entries), names_start, len(names_blob))
+    table = b"".join(
+        BOX.pack(
+            name.encode(),
+            KINDS.index(saved.kind),
+            saved.wins,
+            records_start + offset,
+            count,
+        )
+        for name, saved, offset, count in entries
+    )
+
+    # written next to the old file first, so a failed save keeps the last one
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(table)
+        f.write(records)
+        f.write(names_blob)
+
+    target = os.path.abspath(path)
+    for mapping in list(_mappings):
+        if mapping.path == target:
+            mapping.detach()
+    os.replace(tmp, path)
+
+
+def _check_records(buffer, offset: int, count: int, names_size: int) -> bool:
+    # pokemon types and name offsets of a whole box, without building anything
+    if not count:
+        return True
+    end = offset + count * RECORD.size
+    if not set(buffer[offset : end : RECORD.size]) <= TYPES_BY_ID.keys():
+        return False
+
+    # a record is three little-endian words, the name offset is the last one
+    words = array("I", bytes(buffer[offset:end]))
+    if sys.byteorder == "big":
+        words.byteswap()
+    return max(words[2::3], default=0) + NAME_LENGTH.size <= names_size
+
+
+def read(path: str, vm=None) -> dict[str, SavedBox]:
+    # everything about the layout is checked against the file's size up front,
+    # a broken file is a SaveError here and never an error halfway through a game
+    if os.path.getsize(path) < HEADER.size:
+        raise SaveError(f"{path} is not a save file")
+    source = Mapping(path)
+    buffer = source.buffer
+
+    magic, version, count, names_start, names_size = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SaveError(f"{path} is not a save file")
+    if version != VERSION:
+        raise SaveError(f"{path} has unsupported save version {version}")
+
+    records_start = HEADER.size + count * BOX.size
+    if not records_start <= names_start <= names_start + names_size <= len(buffer):
+        raise SaveError(f"{path} is cut short or damaged")
+
+    boxes = {}
+    for i in range(count):
+        entry = BOX.unpack_from(buffer, HEADER.size + i * BOX.size)
+        name, kind, wins, offset, size = entry
+        if kind >= len(KINDS) or not records_start <= offset:
+            raise SaveError(f"{path} is damaged")
+        if offset + size * RECORD.size > names_start:
+            raise SaveError(f"{path} is cut short or damaged")
+        if not _check_records(buffer, offset, size, names_size):
+            raise SaveError(f"{path} has damaged pokemons")
+        try:
+            name = name.rstrip(b"\0").decode()
+        except UnicodeDecodeError:
+            raise SaveError(f"{path} is damaged") from None
+
+        box = LazyBox(source, offset, names_start, names_size, size, vm)
+        boxes[name] = SavedBox(KINDS[kind], wins, box)
+
+    return boxes
@@ -0,0 +1,161 @@
+import math
+import random
+from typing import NamedTuple, Tuple
+
+from game import outcomes
+from game.battle import Battle
+from game.config import BOT_BOX_SIZE, MAX_ATK, MAX_DF, POKEMONS_PER_TEAM
+from game.pokemons import (
+    POKEMON_TYPES,
+    TRAINER_TYPES,
+    CounterTrainer,
+    Trainer,
+    fill_random_box,
+)
+
+# both sides take turns attacking first, so it is not an advantage; this maps
+# the winner of a swapped battle back to the sides as they were
+SWAPPED_WINNER = {0: 0, 1: 2, 2: 1}
+
+
+class MatchupStats(NamedTuple):
+    first: str
+    second: str
+    battles: int
+    first_wins: int
+    second_wins: int
+
+    @property
+    def win_rate(self) -> float:
+        return self.first_wins / self.battles if self.battles else 0.0
+
+    def confidence_interval(self, z: float = 1.96) -> Tuple[float, float]:
+        # wilson score interval, stays sane near 0% and 100%
+        n = self.battles
+        if n == 0:
+            return 0.0, 1.0
+
+        p = self.win_rate
+        denominator = 1 + z * z / n
+        center = (p + z * z / (2 * n)) / denominator
+        margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+        return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def make_trainer(policy: str, box_size: int = BOT_BOX_SIZE, prefix: str = "T_"):
+    trainer = TRAINER_TYPES[policy]()
+    fill_random_box(trainer, box_size, prefix=prefix)
+    return trainer
+
+
+def play_trainers(
+    player: Trainer,
+    bot: Trainer,
+    team_size: int = POKEMONS_PER_TEAM,
+    cached: bool = False,
+) -> int:
+    # a headless battle to the end. cached goes through the process' outcome
+    # caches, see game.outcomes: the battle's outcome and an expert bot's pick
+    if cached:
+        for trainer in (player, bot):
+            if isinstance(trainer, CounterTrainer):
+                trainer.cache = outcomes.picks
+
+    cache = outcomes.battles if cached else None
+    battle = Battle(team_size, clock=None, record=False, cache=cache)
+    battle.start(player, bot)
+    return battle.fast_forward().winner
+
+
+def play_battle(
+    player_policy: str,
+    bot_policy: str,
+    box_size: int = BOT_BOX_SIZE,
+    team_size: int = POKEMONS_PER_TEAM,
+    cached: bool = False,
+) -> int:
+    player = make_trainer(player_policy, box_size, "T1_")
+    bot = make_trainer(bot_policy, box_size, "T2_")
+    return play_trainers(player, bot, team_size, cached)
+
+
+def _trainer_with(team: list) -> Trainer:
+    trainer = Trainer()
+    for i, (P, atk, df, hp) in enumerate(team):
+        trainer.add(P(f"P{i}", (0, 0), None, atk=atk, df=df, hp=hp))
+    return trainer
+
+
+def _boxes_after(battle: Battle) -> list:
+    return [(p.name, p.hp) for p in battle.player_trainer.box + battle.bot_trainer.box]
+
+
+def crosscheck_resolver(trials: int, seed: int = 0) -> int:
+    # plays random teams hit by hit with Battle.run and compares the closed form
+    # resolution with it, returns the number of checked battles
+    rng = random.Random(seed)
+    for _ in range(trials):
+        teams = []
+        for _ in range(2):
+            team = []
+            for _ in range(rng.randint(0, 6)):
+                P = rng.choice(POKEMON_TYPES)
+                atk, df = rng.randint(0, MAX_ATK * 3), rng.randint(0, MAX_DF * 3)
+                # knocked out pokemons can come back from the player's box
+                hp = rng.choice((0, rng.randint(1, 100), 100))
+                team.append((P, atk, df, hp))
+            teams.append(team)
+
+        stepped = Battle(6, clock=None)
+        stepped.start(_trainer_with(teams[0]), _trainer_with(teams[1]))
+        expected = stepped.run()
+
+        resolved = Battle(6, clock=None)
+        resolved.start(_trainer_with(teams[0]), _trainer_with(teams[1]))
+        result = resolved.fast_forward()
+
+        if (
+            expected.winner != result.winner
+            or expected.turns != result.turns
+            or _boxes_after(stepped) != _boxes_after(resolved)
+        ):
+            raise AssertionError(f"resolver disagrees with Battle on {teams}")
+
+    return trials
+
+
+def run_chunk(
+    task: tuple,
+) -> Tuple[MatchupStats, outcomes.Report, outcomes.Known]:
+    # the chunk's stats, how the process' outcome caches did on it and what
+    # they learned, when they are tracking it
+    first, second, seed, chunk, battles, box_size, cached = task
+
+    # every chunk has its own seed, so runs are reproducible for any worker count
+    random.seed(f"{seed}:{first}:{second}:{chunk}:{box_size}")
+    before = outcomes.stats()
+
+    first_wins = second_wins = 0
+    for i in range(battles):
+        if i % 2 == 0:
+            winner = play_battle(first, second, box_size, cached=cached)
+        else:
+            winner = SWAPPED_WINNER[play_battle(second, first, box_size, cached=cached)]
+
+        if winner == 1:
+            first_wins += 1
+        elif winner == 2:
+            second_wins += 1
+
+    stats = MatchupStats(first, second, battles, first_wins, second_wins)
+    return stats, outcomes.stats_since(before), outcomes.take_new()
+
+
+def merge_stats(a: MatchupStats, b: MatchupStats) -> MatchupStats:
+    return MatchupStats(
+        a.first,
+        a.second,
+        a.battles + b.battles,
+        a.first_wins + b.first_wins,
+        a.second_wins + b.second_wins,
+    )
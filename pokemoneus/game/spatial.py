@@ -0,0 +1,95 @@
+from itertools import count
+from typing import Callable, Dict, Hashable, Optional, Set, Tuple
+
+SPATIAL_CELL_SIZE = 100
+
+CellRange = Tuple[int, int, int, int]
+
+
+class SpatialHash:
+    def __init__(
+        self,
+        cell_size: int = SPATIAL_CELL_SIZE,
+        locate: Optional[Callable[[Hashable], Tuple[int, int]]] = None,
+    ) -> None:
+        self.cell_size = cell_size
+        # with locate, queries check items at their live position, so an item
+        # only has to be moved here when it crosses into other cells
+        self.locate = locate
+        self._cells: Dict[Tuple[int, int], Set[Hashable]] = {}
+        # item -> [insertion order, x, y, w, h, covered cell range]
+        self._items: Dict[Hashable, list] = {}
+        self._order = count()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, item) -> bool:
+        return item in self._items
+
+    def _cell_range(self, x: int, y: int, w: int, h: int) -> CellRange:
+        cs = self.cell_size
+        return x // cs, y // cs, (x + w - 1) // cs, (y + h - 1) // cs
+
+    def _link(self, item, cells: CellRange) -> None:
+        x0, y0, x1, y1 = cells
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                self._cells.setdefault((cx, cy), set()).add(item)
+
+    def _unlink(self, item, cells: CellRange) -> None:
+        x0, y0, x1, y1 = cells
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = self._cells[(cx, cy)]
+                bucket.discard(item)
+                if not bucket:
+                    del self._cells[(cx, cy)]
+
+    def insert(self, item, x: int, y: int, w: int, h: int) -> None:
+        if item in self._items:
+            self.remove(item)
+
+        cells = self._cell_range(x, y, w, h)
+        self._items[item] = [next(self._order), x, y, w, h, cells]
+        self._link(item, cells)
+
+    def remove(self, item) -> None:
+        entry = self._items.pop(item, None)
+        if entry is not None:
+            self._unlink(item, entry[5])
+
+    def move(self, item, x: int, y: int) -> None:
+        entry = self._items[item]
+        if entry[1] == x and entry[2] == y:
+            return
+
+        entry[1], entry[2] = x, y
+        cells = self._cell_range(x, y, entry[3], entry[4])
+        # most frames a pokemon stays inside the same cells
+        if cells != entry[5]:
+            self._unlink(item, entry[5])
+            self._link(item, cells)
+            entry[5] = cells
+
+    def clear(self) -> None:
+        self._cells.clear()
+        self._items.clear()
+
+    def query_point(self, pos: Tuple[int, int]) -> Optional[Hashable]:
+        px, py = pos
+        bucket = self._cells.get((px // self.cell_size, py // self.cell_size))
+        if not bucket:
+            return None
+
+        # the earliest inserted item wins, like a scan over the original list
+        found, found_order = None, None
+        for item in bucket:
+            order, x, y, w, h, _ = self._items[item]
+            if self.locate is not None:
+                x, y = self.locate(item)
+            if x <= px < x + w and y <= py < y + h:
+                if found_order is None or order < found_order:
+                    found, found_order = item, order
+
+        return found
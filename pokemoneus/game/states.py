@@ -2,25 +2,68 @@ import random
 from abc import ABC, abstractmethod
 from typing import List, Optional, Tuple, Union
 
+import game.collision as collision
 import game.controllers as controllers
+import game.swarm as swarm
 import pygame
-from game.battle import Battle
-from game.config import *
+from game.battle import HIT_DELAY, Battle
+from game.config import (
+    BAR_HEIGHT,
+    BASE_POKEMON_SIZE,
+    BOT_BOX_SIZE,
+    COLLISIONS,
+    COLOR_ATTACK_LINE,
+    COLOR_BG_BATTLE,
+    COLOR_BG_MENU,
+    COLOR_DIVIDER,
+    COLOR_HOVER,
+    COLOR_LOSE,
+    COLOR_OVERLAY_BG,
+    COLOR_PANEL,
+    COLOR_PAUSED,
+    COLOR_TEXT_PRIMARY,
+    COLOR_TEXT_SECONDARY,
+    COLOR_TEXT_TITLE,
+    COLOR_WIN,
+    COLOR_WORLD_BG,
+    MAX_WORLD_POKEMONS,
+    POKEMONS_PER_TEAM,
+    REPLAY_FILE,
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+    USE_SWARM,
+)
 from game.misc import Button
-from game.pokemons import POKEMON_TYPES, HardTrainer, MediumTrainer, Pokemon, Trainer
+from game.pokemons import (
+    POKEMON_TYPES,
+    CounterTrainer,
+    HardTrainer,
+    MediumTrainer,
+    Pokemon,
+    Trainer,
+    fill_random_box,
+)
+from game.replay import BattleRecorder, Recording, trainers_from_recording
+from game.spatial import SpatialHash
 from pygame.surface import Surface
 
 # no, it's not chatgpt, it is written for shorter code
 Vec2 = Tuple[int, int]
 Color = Tuple[int, int, int]
 Seconds = float
-BotTrainer = Union[Trainer, MediumTrainer, HardTrainer]
+BotTrainer = Union[Trainer, MediumTrainer, HardTrainer, CounterTrainer]
 
 
 class GameState(ABC):
+    # screens that barely change between frames, menus and overlays, are drawn
+    # with dirty rects when they are on
+    static: bool = False
+    # the speed setting only applies to states that simulate something
+    simulated: bool = False
+
     def __init__(self, game) -> None:
         self.game = game
-        self.vm: controllers.VisualManager = game.vm
+        self.vm: controllers.BaseVisualManager = game.vm
 
     def enter(self) -> None:
         pass
@@ -38,7 +81,121 @@ class GameState(ABC):
         pass
 
 
+class WorldState(GameState):
+    simulated = True
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.pokemons: List[Pokemon] = []
+        self.swarm: Optional[swarm.Swarm] = None
+        if USE_SWARM and swarm.available():
+            self.swarm = swarm.Swarm()
+        self.collisions: bool = COLLISIONS
+        self.max_pokemons: int = MAX_WORLD_POKEMONS
+
+    def clear_pokemons(self) -> None:
+        if self.swarm is not None:
+            self.swarm.clear()
+        self.game.pool.release_all(self.pokemons)
+        self.pokemons = []
+
+    def remove_pokemon(self, pokemon: Pokemon) -> None:
+        self.pokemons.remove(pokemon)
+        if self.swarm is not None:
+            self.swarm.remove(pokemon)
+
+    def recycle_pokemon(self, pokemon: Pokemon) -> None:
+        self.remove_pokemon(pokemon)
+        self.game.pool.release(pokemon)
+
+    def move_pokemons(self) -> None:
+        if self.swarm is not None:
+            self.swarm.step()
+            if self.collisions:
+                self.swarm.collide()
+            return
+
+        for p in self.pokemons:
+            p.move()
+        if self.collisions:
+            collision.collide_pokemons(self.pokemons)
+
+    def draw_pokemons(self, **kwargs) -> None:
+        alpha = self.game.alpha
+        if self.swarm is not None:
+            xs, ys = self.swarm.interpolated(alpha)
+            for p in self.pokemons:
+                p.draw(pos=(xs[p._slot], ys[p._slot]), **kwargs)
+            return
+
+        for p in self.pokemons:
+            p.draw(pos=self.drawn_pos(p), **kwargs)
+
+    def drawn_pos(self, p: Pokemon) -> tuple:
+        # between the last two ticks, where draw_pokemons puts it
+        alpha = self.game.alpha
+        if self.swarm is not None:
+            px, py = self.swarm.previous(p)
+        else:
+            px, py = p.px, p.py
+        x, y = p.x, p.y
+        return px + round((x - px) * alpha), py + round((y - py) * alpha)
+
+    def add_new_random_pokemon(self, pos: Vec2) -> None:
+        # a full world makes room by recycling its oldest pokemon
+        while self.pokemons and len(self.pokemons) >= self.max_pokemons:
+            self.recycle_pokemon(self.pokemons[0])
+
+        pokemon_type = random.choice(POKEMON_TYPES)
+        if self.swarm is not None:
+            pokemon_type = swarm.view_type(pokemon_type)
+        pokemon = self.game.pool.acquire(pokemon_type, "Pokemon", pos, vm=self.vm)
+        if self.swarm is not None:
+            self.swarm.add(pokemon)
+        self.pokemons.append(pokemon)
+
+
+class LoadingState(GameState):
+    # shown while the asset loader decodes sprites, then hands over to the menu
+    static = True
+
+    def handle_event(self, event: pygame.event.Event) -> None:
+        pass
+
+    def update(self) -> None:
+        loader = self.game.loader
+        loader.poll()
+        # a file that failed to decode fails again, loudly, when it's drawn
+        if loader.done:
+            self.game.state = "menu"
+
+    def draw(self) -> None:
+        self.vm.clear_screen(COLOR_BG_MENU)
+
+        loader = self.game.loader
+        text = "Loading..."
+        tw, th = self.vm.get_text_size(text, font_size=48)
+        self.vm.draw_text(
+            ((SCREEN_WIDTH - tw) // 2, (SCREEN_HEIGHT - th) // 2 - 30),
+            text,
+            COLOR_TEXT_TITLE,
+            font_size=48,
+        )
+
+        bar_w = 400
+        self.vm.draw_bar(
+            ((SCREEN_WIDTH - bar_w) // 2, SCREEN_HEIGHT // 2 + 30),
+            bar_w,
+            BAR_HEIGHT * 2,
+            COLOR_TEXT_TITLE,
+            loader.loaded,
+            len(loader.files),
+        )
+
+
 class MainMenuState(GameState):
+    static = True
+
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
@@ -113,21 +270,53 @@ class MainMenuState(GameState):
             btn.draw()
 
 
-class CollectingPokemonsState(GameState):
+class CollectingPokemonsState(WorldState):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
-        self.pokemons: List[Pokemon] = []
+        self.index: SpatialHash = SpatialHash(locate=lambda p: (p.x, p.y))
+        self.mouse_pos: Optional[Vec2] = None
+        self.hovered: Optional[Pokemon] = None
 
     def enter(self) -> None:
-        self.pokemons = []
+        self.clear_pokemons()
+        self.hovered = None
         for _ in range(random.randint(20, 30)):
             x = random.randint(0, SCREEN_WIDTH - BASE_POKEMON_SIZE[0])
             y = random.randint(0, SCREEN_HEIGHT - BASE_POKEMON_SIZE[1])
             self.add_new_random_pokemon((x, y))
 
+    def clear_pokemons(self) -> None:
+        super().clear_pokemons()
+        self.index.clear()
+
+    def remove_pokemon(self, pokemon: Pokemon) -> None:
+        super().remove_pokemon(pokemon)
+        self.index.remove(pokemon)
+        if self.hovered is pokemon:
+            self.hovered = None
+
+    def add_new_random_pokemon(self, pos: Vec2) -> None:
+        super().add_new_random_pokemon(pos)
+        p = self.pokemons[-1]
+        self.index.insert(p, p.x, p.y, *p.size)
+
+    def update_index(self) -> None:
+        if self.swarm is None:
+            for p in self.pokemons:
+                self.index.move(p, p.x, p.y)
+            return
+
+        # the swarm finds who crossed into other cells in one pass over its
+        # arrays, everyone else stays in their buckets
+        for p, x, y in self.swarm.crossed(self.index.cell_size):
+            self.index.move(p, x, y)
+
     def handle_event(self, event: pygame.event.Event) -> None:
         if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
             self.game.state = "menu"
+        elif event.type == pygame.MOUSEMOTION:
+            self.mouse_pos = event.pos
+            self.hovered = self.index.query_point(event.pos)
         elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
             for p in list(self.game.box):
                 rect = p.image.get_rect(topleft=(p.x, p.y))
@@ -135,19 +324,21 @@ class CollectingPokemonsState(GameState):
                     self.game.box.remove(p)
                     break
 
-            for p in list(self.pokemons):
-                rect = p.image.get_rect(topleft=(p.x, p.y))
-                if rect.collidepoint(event.pos):
-                    self.pokemons.remove(p)
-                    self.game.box.append(p)
-                    break
+            p = self.index.query_point(event.pos)
+            if p is not None:
+                self.remove_pokemon(p)
+                self.game.box.append(p)
 
             if len(self.game.box) > POKEMONS_PER_TEAM:
                 self.game.box.pop(0)
 
     def update(self) -> None:
-        for p in self.pokemons:
-            p.move()
+        self.move_pokemons()
+        self.update_index()
+
+        # pokemons keep moving under a still cursor
+        if self.mouse_pos is not None:
+            self.hovered = self.index.query_point(self.mouse_pos)
 
         for i in range(len(self.game.box)):
             self.game.box[i].x = 5 + 7 + (BASE_POKEMON_SIZE[0] + 7) * i
@@ -156,8 +347,17 @@ class CollectingPokemonsState(GameState):
     def draw(self) -> None:
         self.vm.clear_screen(COLOR_WORLD_BG)
 
-        for p in self.pokemons:
-            p.draw(draw_hp_bar=False)
+        self.draw_pokemons(draw_hp_bar=False)
+
+        if self.hovered is not None:
+            x, y = self.drawn_pos(self.hovered)
+            self.vm.draw_rectangle(
+                (x - 2, y - 2),
+                self.hovered.size[0] + 4,
+                self.hovered.size[1] + 4,
+                COLOR_HOVER,
+                border=2,
+            )
 
         if self.game.box:
             box_w = 7 + (BASE_POKEMON_SIZE[0] + 7) * len(self.game.box)
@@ -167,29 +367,64 @@ class CollectingPokemonsState(GameState):
             for p in self.game.box:
                 p.draw()
 
-    def add_new_random_pokemon(self, pos: Vec2) -> None:
-        pokemon_type = random.choice(POKEMON_TYPES)
-        self.pokemons.append(pokemon_type("Pokemon", pos, vm=self.vm))
-
 
 class BattleState(GameState):
+    simulated = True
+
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
-        self.battle: Battle = Battle(POKEMONS_PER_TEAM)
-        self.trainer1: Trainer = Trainer()
-        self.trainer2: BotTrainer = Trainer()
+        self.battle: Battle = self.new_battle()
+        trainers = self.game.saved_trainers or (Trainer(), Trainer())
+        self.trainer1: Trainer = trainers[0]
+        self.trainer2: BotTrainer = trainers[1]
         self.spacing: int = (BAR_HEIGHT + 2) * 3 + 2 + 20
         self.winner: Optional[str] = None
-        self._wins_snapshot: Tuple[int, int] = (0, 0)
         self._was_running: bool = False
+        # every battle gets its own random stream, so it can be played again
+        self.seed: int = 0
+        self.replaying: bool = False
+        # everything fill_boxes took from the pool, knocked out ones included
+        self._bot_pokemons: List[Pokemon] = []
         self.paused: bool = False
         self.difficulty: Optional[str] = None
         self.y_start: int = 0
         self.x1: int = 0
         self.x2: int = 0
 
+    @property
+    def static(self) -> bool:
+        # the difficulty and result overlays
+        return self.difficulty is None or self.winner is not None
+
+    def new_battle(
+        self,
+        n: int = POKEMONS_PER_TEAM,
+        rate: Optional[float] = 1.0,
+        recorder: Optional[BattleRecorder] = None,
+    ) -> Battle:
+        # rate None plays one hit per tick
+        if rate is None:
+            return Battle(n, clock=None, recorder=recorder)
+        # hits are paced in simulated time, so faster speeds speed up battles too
+        return Battle(
+            n,
+            clock=lambda: self.game.sim_time,
+            hit_delay=HIT_DELAY / rate,
+            recorder=recorder,
+        )
+
     def _reset_enemy_box(self) -> None:
         self.trainer2.box = []
+        # the bot's pokemons of the last battle are reused for the next one
+        self.game.pool.release_all(self._bot_pokemons)
+        self._bot_pokemons = []
+
+    def _back_to_menu(self) -> None:
+        self._reset_enemy_box()
+        # a battle left halfway keeps the part of its recording played so far
+        if self.battle.recorder is not None:
+            self.battle.recorder.close()
+        self.game.state = "menu"
 
     def _set_bot_by_difficulty(self) -> None:
         old_wins: int = getattr(self.trainer2, "wins", 0)
@@ -199,16 +434,18 @@ class BattleState(GameState):
             self.trainer2 = MediumTrainer()
         elif self.difficulty == "hard":
             self.trainer2 = HardTrainer()
+        elif self.difficulty == "expert":
+            self.trainer2 = CounterTrainer()
         self.trainer2.wins = old_wins
 
     def fill_boxes(self) -> None:
         self.trainer1.box = list(self.game.box)
-        self.trainer2.box = []
-        while len(self.trainer2.box) < 30:
-            P = random.choice(POKEMON_TYPES)
-            self.trainer2.add(
-                P(f"T2_{len(self.trainer2.box)+1}", (0, 0), is_bot=True, vm=self.vm)
-            )
+        self._reset_enemy_box()
+        rng = random.Random(self.seed)
+        fill_random_box(
+            self.trainer2, BOT_BOX_SIZE, vm=self.vm, rng=rng, pool=self.game.pool
+        )
+        self._bot_pokemons = list(self.trainer2.box)
 
     def _compute_center_layout(self) -> None:
         column_gap = 120
@@ -238,18 +475,32 @@ class BattleState(GameState):
         self.winner = None
         self.paused = False
         self.difficulty = None
-        self._wins_snapshot = (self.trainer1.wins, self.trainer2.wins)
         self._was_running = False
+        self.replaying = False
 
     def _start_after_difficulty(self) -> None:
+        self.seed = random.getrandbits(32)
         self._set_bot_by_difficulty()
         self.fill_boxes()
-        self.battle = Battle(POKEMONS_PER_TEAM)
+        recorder = BattleRecorder(REPLAY_FILE, self.seed) if REPLAY_FILE else None
+        self.battle = self.new_battle(recorder=recorder)
         self.battle.start(self.trainer1, self.trainer2)
         self._compute_center_layout()
         self._position_teams()
         self._was_running = True
 
+    def play_replay(self, recording: Recording, rate: Optional[float] = 1.0) -> None:
+        # the recorded teams fight with their own trainers, wins aren't counted
+        self.enter()
+        self.replaying = True
+        self.seed = recording.seed
+        self.difficulty = recording.bot_kind or "easy"
+        self.battle = self.new_battle(recording.team_size, rate)
+        self.battle.start(*trainers_from_recording(recording, vm=self.vm))
+        self._compute_center_layout()
+        self._position_teams()
+        self._was_running = True
+
     def handle_event(self, event: pygame.event.Event) -> None:
         if self.difficulty is None:
             if event.type == pygame.KEYDOWN:
@@ -262,21 +513,22 @@ class BattleState(GameState):
                 elif event.key in (pygame.K_3, pygame.K_h):
                     self.difficulty = "hard"
                     self._start_after_difficulty()
+                elif event.key in (pygame.K_4, pygame.K_x):
+                    self.difficulty = "expert"
+                    self._start_after_difficulty()
                 elif event.key == pygame.K_ESCAPE:
-                    self._reset_enemy_box()
-                    self.game.state = "menu"
+                    self._back_to_menu()
             return
 
         if self.winner is not None:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
-                    self._reset_enemy_box()
-                    self.game.state = "menu"
+                    self._back_to_menu()
                 elif event.key == pygame.K_SPACE:
                     if self.winner == "paused":
                         self.winner = None
                         self.paused = False
-                        self.battle.last_update = pygame.time.get_ticks()
+                        self.battle.last_update = self.battle.now()
                         self._was_running = True
             return
 
@@ -294,11 +546,10 @@ class BattleState(GameState):
         if running_now:
             self.battle.update()
         if self._was_running and not bool(self.battle.started):
-            t1_w, t2_w = self.trainer1.wins, self.trainer2.wins
-            p_w0, b_w0 = self._wins_snapshot
-            if t1_w > p_w0:
+            result = self.battle.result
+            if result is not None and result.winner == 1:
                 self.winner = "player"
-            elif t2_w > b_w0:
+            elif result is not None and result.winner == 2:
                 self.winner = "bot"
             else:
                 if self.winner is None:
@@ -308,7 +559,7 @@ class BattleState(GameState):
     def _draw_difficulty_overlay(self) -> None:
         self.vm.clear_screen(COLOR_OVERLAY_BG)
         title = "Choose Difficulty"
-        opt = "1) Easy    2) Medium    3) Hard"
+        opt = "1) Easy    2) Medium    3) Hard    4) Expert"
         tw, th = self.vm.get_text_size(title, font_size=64)
         self.vm.draw_text(
             ((SCREEN_WIDTH - tw) // 2, (SCREEN_HEIGHT - th) // 2 - 30),
@@ -362,7 +613,7 @@ class BattleState(GameState):
             (SCREEN_WIDTH // 2, 0), (SCREEN_WIDTH // 2, SCREEN_HEIGHT), COLOR_DIVIDER, 2
         )
 
-        you_text = "You"
+        you_text = "Replay" if self.replaying else "You"
         bot_text = f"{self.difficulty.capitalize()} Bot"
 
         yw, yh = self.vm.get_text_size(you_text, font_size=32)
@@ -404,21 +655,17 @@ class BattleState(GameState):
             self.vm.draw_text((20, 50), "ESC = menu", COLOR_TEXT_SECONDARY, 20)
 
 
-class FpsStateState(GameState):
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self.pokemons: List[Pokemon] = []
-
+class FpsStateState(WorldState):
     def enter(self) -> None:
-        self.pokemons = []
+        self.clear_pokemons()
 
     def handle_event(self, event: pygame.event.Event) -> None:
         if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
             self.game.state = "menu"
 
     def update(self) -> None:
-        if pygame.key.get_pressed()[pygame.K_SPACE]:
-            mouse_pos = pygame.mouse.get_pos()
+        if self.vm.key_pressed(pygame.K_SPACE):
+            mouse_pos = self.vm.mouse_pos()
             for _ in range(10):
                 self.add_new_random_pokemon(
                     (
@@ -427,13 +674,11 @@ class FpsStateState(GameState):
                     )
                 )
 
-        for p in self.pokemons:
-            p.move()
+        self.move_pokemons()
 
     def draw(self) -> None:
         self.vm.clear_screen(COLOR_WORLD_BG)
-        for p in self.pokemons:
-            p.draw(draw_hp_bar=False, draw_stats=False)
+        self.draw_pokemons(draw_hp_bar=False, draw_stats=False)
 
         counter_text = f"Pokemons: {len(self.pokemons)}"
         tw, th = self.vm.get_text_size(counter_text, font_size=20)
@@ -465,7 +710,3 @@ class FpsStateState(GameState):
             COLOR_TEXT_SECONDARY,
             20,
         )
-
-    def add_new_random_pokemon(self, pos: Vec2) -> None:
-        pokemon_type = random.choice(POKEMON_TYPES)
-        self.pokemons.append(pokemon_type("Pokemon", pos, vm=self.vm))
@@ -0,0 +1,206 @@
+import game.collision as collision
+from game.config import SCREEN_HEIGHT, SCREEN_WIDTH
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, states fall back to Pokemon.move
+    np = None
+
+SWARM_CAPACITY = 256
+
+# per-entity columns kept in the swarm arrays, px/py hold the previous tick's position
+FIELDS = ("x", "y", "dx", "dy", "w", "h", "hp", "px", "py")
+VIEW_FIELDS = ("x", "y", "dx", "dy", "hp")
+
+
+def available() -> bool:
+    return np is not None
+
+
+class Swarm:
+    def __init__(self, capacity: int = SWARM_CAPACITY, seed=None) -> None:
+        if np is None:
+            raise RuntimeError("the swarm engine needs numpy installed")
+
+        self.count = 0
+        self.members: list = []
+        self.rng = np.random.default_rng(seed)
+
+        for name in FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=np.int64))
+
+    @property
+    def capacity(self) -> int:
+        return len(self.x)
+
+    def _grow(self) -> None:
+        capacity = self.capacity * 2
+        for name in FIELDS:
+            column = np.zeros(capacity, dtype=np.int64)
+            column[: self.count] = getattr(self, name)[: self.count]
+            setattr(self, name, column)
+
+    def add(self, pokemon) -> None:
+        if pokemon._swarm is self:
+            return
+        if pokemon._swarm is not None:
+            pokemon._swarm.remove(pokemon)
+
+        if self.count == self.capacity:
+            self._grow()
+
+        i = self.count
+        for name in VIEW_FIELDS:
+            getattr(self, name)[i] = getattr(pokemon, name)
+        self.w[i], self.h[i] = pokemon.size
+        self.px[i], self.py[i] = self.x[i], self.y[i]
+
+        pokemon._swarm, pokemon._slot = self, i
+        self.members.append(pokemon)
+        self.count += 1
+
+    def remove(self, pokemon) -> None:
+        if pokemon._swarm is not self:
+            return
+
+        i, last = pokemon._slot, self.count - 1
+
+        # detach first so the pokemon keeps its last values in its own slots
+        values = [int(getattr(self, name)[i]) for name in VIEW_FIELDS]
+        pokemon._swarm, pokemon._slot = None, -1
+        for name, value in zip(VIEW_FIELDS, values):
+            setattr(pokemon, name, value)
+
+        # swap-remove keeps the arrays dense
+        if i != last:
+            for name in FIELDS:
+                column = getattr(self, name)
+                column[i] = column[last]
+            moved = self.members[last]
+            moved._slot = i
+            self.members[i] = moved
+
+        self.members.pop()
+        self.count -= 1
+
+    def clear(self) -> None:
+        for pokemon in list(self.members):
+            self.remove(pokemon)
+
+    def step(self) -> None:
+        n = self.count
+        if n == 0:
+            return
+
+        x, y = self.x[:n], self.y[:n]
+        dx, dy = self.dx[:n], self.dy[:n]
+        alive = self.hp[:n] > 0
+        self.px[:n], self.py[:n] = x, y
+
+        # same order as Pokemon.move: horizontal walls first, then vertical ones
+        hit = alive & ((x <= 0) | (x + self.w[:n] >= SCREEN_WIDTH))
+        if hit.any():
+            dx[hit] *= -1
+            dy[hit] += self.rng.integers(-1, 2, int(hit.sum()))
+
+        hit = alive & ((y <= 0) | (y + self.h[:n] >= SCREEN_HEIGHT))
+        if hit.any():
+            dy[hit] *= -1
+            dx[hit] += self.rng.integers(-1, 2, int(hit.sum()))
+
+        x += np.where(alive, dx, 0)
+        y += np.where(alive, dy, 0)
+
+    def collide(self) -> int:
+        n = self.count
+        names = ("x", "y", "dx", "dy", "w", "h")
+        alive = np.flatnonzero(self.hp[:n] > 0)
+        if len(alive) == n:
+            return collision.collide(*(getattr(self, name)[:n] for name in names))
+
+        # knocked out pokemons stay out of it
+        columns = [getattr(self, name)[alive] for name in names]
+        pairs = collision.collide(*columns)
+        for name, column in zip(names[:4], columns):
+            getattr(self, name)[alive] = column
+        return pairs
+
+    def crossed(self, cell_size: int) -> list:
+        # (member, x, y) of everyone whose box covers other cells of a
+        # cell_size grid than before the last step
+        n = self.count
+        x, y, px, py = self.x[:n], self.y[:n], self.px[:n], self.py[:n]
+        w, h = self.w[:n] - 1, self.h[:n] - 1
+        moved = (
+            (x // cell_size != px // cell_size)
+            | (y // cell_size != py // cell_size)
+            | ((x + w) // cell_size != (px + w) // cell_size)
+            | ((y + h) // cell_size != (py + h) // cell_size)
+        )
+        members = self.members
+        return [
+            (members[i], int(self.x[i]), int(self.y[i])) for i in np.flatnonzero(moved)
+        ]
+
+    def previous(self, pokemon) -> tuple[int, int]:
+        i = pokemon._slot
+        return int(self.px[i]), int(self.py[i])
+
+    def interpolated(self, alpha: float) -> tuple[list, list]:
+        # positions between the last two ticks, as python ints for drawing
+        n = self.count
+        px, py = self.px[:n], self.py[:n]
+        xs = px + np.rint((self.x[:n] - px) * alpha).astype(np.int64)
+        ys = py + np.rint((self.y[:n] - py) * alpha).astype(np.int64)
+        return xs.tolist(), ys.tolist()
+
+
+def _slot_of(pokemon_type: type, name: str):
+    for klass in pokemon_type.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    raise AttributeError(name)
+
+
+def _view_property(pokemon_type: type, name: str, clamp: bool = False) -> property:
+    # while detached the value lives in the pokemon's own slot
+    slot = _slot_of(pokemon_type, name)
+
+    def fget(self):
+        swarm = self._swarm
+        if swarm is None:
+            return slot.__get__(self)
+        return int(getattr(swarm, name)[self._slot])
+
+    def fset(self, value) -> None:
+        if clamp:
+            value = max(0, value)
+        swarm = self._swarm
+        if swarm is None:
+            slot.__set__(self, value)
+        else:
+            getattr(swarm, name)[self._slot] = value
+
+    return property(fget, fset)
+
+
+_view_types: dict = {}
+
+
+def view_type(pokemon_type):
+    # a subclass with the same name, so type checks and sprites keep working
+    view = _view_types.get(pokemon_type)
+    if view is None:
+
+        def __init__(self, *args, **kwargs) -> None:
+            self._swarm, self._slot = None, -1
+            pokemon_type.__init__(self, *args, **kwargs)
+
+        namespace = {"__slots__": ("_swarm", "_slot"), "__init__": __init__}
+        for name in VIEW_FIELDS:
+            namespace[name] = _view_property(pokemon_type, name, clamp=name == "hp")
+        view = type(pokemon_type.__name__, (pokemon_type,), namespace)
+        view.__qualname__ = pokemon_type.__qualname__
+        _view_types[pokemon_type] = view
+
+    return view
@@ -0,0 +1,140 @@
+import os
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import itertools
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from game import outcomes
+from game.config import BOT_BOX_SIZE, POKEMONS_PER_TEAM
+from game.league import K_FACTOR, League, make_entrants, round_robin
+from game.pokemons import TRAINER_TYPES
+
+FORMATS = ("swiss", "round-robin")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Rank many trainers, each a policy with its own box, by elo."
+    )
+    parser.add_argument(
+        "policies",
+        nargs="*",
+        default=list(TRAINER_TYPES),
+        help=f"policies the trainers take turns with: {', '.join(TRAINER_TYPES)}",
+    )
+    parser.add_argument("-t", "--trainers", type=int, default=1_000)
+    parser.add_argument("-f", "--format", choices=FORMATS, default="swiss")
+    parser.add_argument(
+        "-r",
+        "--rounds",
+        type=int,
+        help="rounds to play, by default log2 of the trainers for swiss and "
+        "all of them for round-robin",
+    )
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-k", type=float, default=K_FACTOR)
+    parser.add_argument("--shard-size", type=int, default=256)
+    parser.add_argument("--box-size", type=int, default=BOT_BOX_SIZE)
+    parser.add_argument("--team-size", type=int, default=POKEMONS_PER_TEAM)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--every",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help="how often the standings are printed while the league runs",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="PATH",
+        help="keep battle outcomes and expert picks in this file between runs, "
+        "games between teams that already met are skipped",
+    )
+
+    args = parser.parse_args()
+    for policy in args.policies:
+        if policy not in TRAINER_TYPES:
+            parser.error(f"unknown policy {policy!r}")
+    if args.trainers < 2:
+        parser.error("need at least two trainers")
+    return args
+
+
+def report(league: League, top: int, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    print(
+        f"-- {league.matches} matches in {elapsed:.1f}s, "
+        f"{league.matches / elapsed:,.0f} matches/s"
+    )
+    for place, s in enumerate(league.standings(top), 1):
+        print(
+            f"{place:>4}. {s.entrant.name:<14} {s.rating:7.1f}  "
+            f"{s.wins:>4}-{s.losses}-{s.draws}"
+        )
+
+
+def main() -> None:
+    args = parse_args()
+    policies = list(dict.fromkeys(args.policies))
+    entrants = make_entrants(args.trainers, policies, args.seed)
+    league = League(
+        entrants, args.k, args.box_size, args.team_size, cached=bool(args.cache)
+    )
+
+    if args.format == "swiss":
+        rounds = args.rounds or math.ceil(math.log2(args.trainers))
+    else:
+        every_round = len(entrants) - 1 + len(entrants) % 2
+        rounds = min(args.rounds or every_round, every_round)
+    print(
+        f"{args.trainers} trainers, {args.format}, {rounds} rounds "
+        f"on {args.workers} worker(s)"
+    )
+
+    known = outcomes.load_known(args.cache)
+
+    started = last_report = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=outcomes.init_worker,
+        initargs=(known, bool(args.cache)),
+    ) as executor:
+        if args.format == "swiss":
+            # every round is paired from the standings the last one left, and
+            # spread over all workers
+            schedule = (league.swiss_pairs() for _ in range(rounds))
+        else:
+            # pairings don't depend on results, so one round follows the other
+            # without waiting; they are made as the workers get to them
+            schedule = [
+                itertools.chain.from_iterable(
+                    itertools.islice(round_robin(entrants), rounds)
+                )
+            ]
+
+        # every round has about half the trainers in pairs
+        shard_size = min(args.shard_size, math.ceil(len(entrants) / 2 / args.workers))
+        for pairs in schedule:
+            for _ in league.play(
+                pairs, executor, max(1, shard_size), in_flight=2 * args.workers
+            ):
+                if time.perf_counter() - last_report >= args.every:
+                    report(league, args.top, started)
+                    last_report = time.perf_counter()
+
+    report(league, args.top, started)
+    print("-- average rating per policy")
+    ratings = league.policy_ratings()
+    for policy in sorted(ratings, key=ratings.get, reverse=True):
+        print(f"{policy:>8} {ratings[policy]:7.1f}")
+
+    outcomes.save_known(args.cache, league.cache_stats, prefix="-- ")
+
+
+if __name__ == "__main__":
+    main()
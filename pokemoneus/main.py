@@ -1,9 +1,19 @@
+import os
+
 import pygame
-from game.config import FPS, SCREEN_HEIGHT, SCREEN_WIDTH
+from game.config import DIRTY_RECTS, FPS, SAVE_FILE, SCREEN_HEIGHT, SCREEN_WIDTH
 from game.controllers import GameManager, VisualManager
+from game.savefile import SaveError
 
-visuals = VisualManager((SCREEN_WIDTH, SCREEN_HEIGHT), "Pokemoneus!")
+visuals = VisualManager(
+    (SCREEN_WIDTH, SCREEN_HEIGHT), "Pokemoneus!", dirty_rects=DIRTY_RECTS
+)
 game = GameManager(visuals)
+if os.path.exists(SAVE_FILE):
+    try:
+        game.load(SAVE_FILE)
+    except SaveError as e:
+        print(f"starting without a save: {e}")
 
 while game.running:
     game.handle_events()
@@ -11,7 +21,8 @@ while game.running:
     game.update()
     game.draw()
 
-    visuals.update_screen()
+    game.update_screen()
     visuals.clock.tick(FPS)
 
+game.save(SAVE_FILE)
 pygame.quit()
@@ -0,0 +1,98 @@
+import os
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import time
+
+import pygame
+from game.config import DIRTY_RECTS, FPS, REPLAY_FILE, SCREEN_HEIGHT, SCREEN_WIDTH
+from game.controllers import GameManager, VisualManager
+from game.replay import Recording, ReplayError, read, replay
+
+WINNERS = {0: "nobody", 1: "player", 2: "bot"}
+
+
+def playback_rate(value: str):
+    if value == "max":
+        return None
+    rate = float(value)
+    if rate <= 0:
+        raise argparse.ArgumentTypeError("the rate has to be positive")
+    return rate
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Play a recorded battle again, headless or in the game window."
+    )
+    parser.add_argument("path", nargs="?", default=REPLAY_FILE)
+    parser.add_argument(
+        "--watch", action="store_true", help="show the battle in the game window"
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        type=playback_rate,
+        default=1.0,
+        help="playback speed for --watch, 'max' plays a hit per tick",
+    )
+    parser.add_argument(
+        "-n", "--repeat", type=int, default=1, help="headless runs, for timing"
+    )
+    return parser.parse_args()
+
+
+def headless(recording: Recording, repeat: int) -> None:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = replay(recording)
+    elapsed = time.perf_counter() - start
+
+    if recording.result is None:
+        print(
+            f"seed {recording.seed}: the recording stops after "
+            f"{len(recording.events)} events, the replay agrees with all of them"
+        )
+    else:
+        print(
+            f"seed {recording.seed}: {WINNERS[result.winner]} wins after "
+            f"{result.turns} turns, same as recorded"
+        )
+    print(f"{repeat} replays in {elapsed * 1000:.1f} ms")
+
+
+def watch(recording: Recording, rate) -> None:
+    visuals = VisualManager(
+        (SCREEN_WIDTH, SCREEN_HEIGHT), "Pokemoneus! replay", dirty_rects=DIRTY_RECTS
+    )
+    game = GameManager(visuals, preload=False)
+    game.state = "battle"
+    game.state.play_replay(recording, rate)
+
+    while game.running:
+        game.handle_events()
+
+        game.update()
+        game.draw()
+
+        game.update_screen()
+        visuals.clock.tick(FPS)
+
+    pygame.quit()
+
+
+def main() -> None:
+    args = parse_args()
+    try:
+        recording = read(args.path)
+        if args.watch:
+            watch(recording, args.rate)
+        else:
+            headless(recording, args.repeat)
+    except (OSError, ReplayError) as e:
+        raise SystemExit(f"{args.path}: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from game import outcomes
+from game.config import BOT_BOX_SIZE
+from game.pokemons import TRAINER_TYPES
+from game.simulation import (
+    MatchupStats,
+    crosscheck_resolver,
+    merge_stats,
+    run_chunk,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Play seeded battles between trainer policies and report win rates."
+    )
+    parser.add_argument(
+        "policies",
+        nargs="*",
+        default=["easy", "medium", "hard"],
+        help=f"policies to pit against each other: {', '.join(TRAINER_TYPES)}; "
+        "expert searches every lineup and is left out unless asked for",
+    )
+    parser.add_argument("-n", "--battles", type=int, default=100_000)
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=2_000)
+    parser.add_argument("--box-size", type=int, default=BOT_BOX_SIZE)
+    parser.add_argument(
+        "--verify",
+        type=int,
+        default=0,
+        metavar="N",
+        help="first check the closed form resolver against N hit-by-hit battles",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="PATH",
+        help="keep battle outcomes and expert picks in this file between runs, "
+        "battles between teams that already met are skipped",
+    )
+
+    args = parser.parse_args()
+    for policy in args.policies:
+        if policy not in TRAINER_TYPES:
+            parser.error(f"unknown policy {policy!r}")
+    return args
+
+
+def make_tasks(args, first: str, second: str) -> list:
+    tasks = []
+    for chunk, start in enumerate(range(0, args.battles, args.chunk_size)):
+        battles = min(args.chunk_size, args.battles - start)
+        tasks.append(
+            (first, second, args.seed, chunk, battles, args.box_size, bool(args.cache))
+        )
+    return tasks
+
+
+def report(stats: MatchupStats) -> None:
+    low, high = stats.confidence_interval()
+    print(
+        f"{stats.first:>6} vs {stats.second:<6}  {stats.battles:>10}  "
+        f"{stats.win_rate:7.2%}  [{low:.2%}, {high:.2%}]  "
+        f"draws {stats.battles - stats.first_wins - stats.second_wins}"
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    if args.verify:
+        checked = crosscheck_resolver(args.verify, args.seed)
+        print(f"resolver matches Battle on {checked} random battles")
+
+    matchups = list(itertools.combinations(dict.fromkeys(args.policies), 2))
+    if not matchups:
+        raise SystemExit("need at least two different policies")
+
+    known = outcomes.load_known(args.cache)
+
+    print(f"{args.battles} battles per matchup on {args.workers} worker(s)")
+    print(f"{'matchup':^16}  {'battles':>10}  {'1st wins':>7}  95% CI")
+
+    total, started = 0, time.perf_counter()
+    cache_stats = (outcomes.CacheStats(), outcomes.CacheStats())
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=outcomes.init_worker,
+        initargs=(known, bool(args.cache)),
+    ) as executor:
+        # queue every matchup up front so no worker idles between them
+        pending = [
+            executor.map(run_chunk, make_tasks(args, first, second))
+            for first, second in matchups
+        ]
+        for (first, second), chunks in zip(matchups, pending):
+            stats = MatchupStats(first, second, 0, 0, 0)
+            for chunk, chunk_cache, learned in chunks:
+                stats = merge_stats(stats, chunk)
+                cache_stats = outcomes.merge_reports(cache_stats, chunk_cache)
+                outcomes.update(learned)
+            report(stats)
+            total += stats.battles
+
+    elapsed = time.perf_counter() - started
+    print(f"{total} battles in {elapsed:.2f}s, {total / elapsed:,.0f} battles/s")
+    outcomes.save_known(args.cache, cache_stats)
+
+
+if __name__ == "__main__":
+    main()